@@ -1,8 +1,8 @@
-import streamlit as st
-
-def app():
-    st.subheader('Pondering is a website created for users to')
-    st.subheader('share their valuable thoughts with the world.')
-    st.markdown('Created by: [Saurabh kumar](https://github.com/imsaurabhkr)')
-    st.markdown('Contact via mail: [saurabhkumar841301@gmail.com]')
+import streamlit as st
+
+def app():
+    st.subheader('Pondering is a website created for users to')
+    st.subheader('share their valuable thoughts with the world.')
+    st.markdown('Created by: [Saurabh kumar](https://github.com/imsaurabhkr)')
+    st.markdown('Contact via mail: [saurabhkumar841301@gmail.com]')
     
\ No newline at end of file
@@ -0,0 +1,179 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# In-process cache of generated answers, scoped per (class, subject, chapter).
+# Lookups try an exact match on the normalised question first, then the most similar
+# cached question of the same scope by cosine similarity of the query embeddings. Either way the
+# numbers and maths symbols of the two questions have to be identical: "HCF of 12 and 18" and
+# "HCF of 12 and 16" embed almost the same but need different answers.
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(6 * 3600)))
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+# Looser match used only while Gemini is unavailable, see get_fallback()
+FALLBACK_SIMILARITY = float(os.getenv("ANSWER_CACHE_FALLBACK_SIMILARITY", "0.85"))
+
+# Numbers and operators; a hyphen only counts as minus when it is not joining two words
+QUESTION_TERMS = re.compile(r"\d+(?:\.\d+)?|[+*/^=<>%√π²³°×÷±≤≥∠△∆]|(?<![^\W\d_])-|-(?![^\W\d_])")
+
+
+def normalize_query(query):
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def question_signature(query):
+    # The numbers and symbols of the question in order, e.g. ("12", "18") for "HCF of 12 and 18?"
+    return tuple(QUESTION_TERMS.findall(query))
+
+
+def _key(scope, query):
+    # (scope, normalised query, signature); normalising drops the symbols, so they are kept apart
+    return (scope, normalize_query(query), question_signature(query))
+
+
+class _Entry:
+    def __init__(self, answer, embedding, version):
+        self.answer = answer
+        self.embedding = embedding
+        self.version = version
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, similarity_threshold=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        # (scope, normalised query, signature) -> _Entry, ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "fallback_hits": 0}
+
+    def _usable(self, key, entry, version):
+        # Entries expire after the TTL and whenever the chapter was re-ingested since they were stored
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._counters["expirations"] += 1
+        elif entry.version != version:
+            self._counters["invalidations"] += 1
+        else:
+            return True
+        del self._entries[key]
+        return False
+
+    def get(self, scope, query, embedding=None, version=None):
+        key = _key(scope, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._usable(key, entry, version):
+                self._entries.move_to_end(key)
+                self._counters["exact_hits"] += 1
+                return entry.answer
+
+            if embedding is not None:
+                best_key = self._nearest(key, embedding, version)
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._counters["semantic_hits"] += 1
+                    return self._entries[best_key].answer
+
+            self._counters["misses"] += 1
+            return None
+
+    def peek(self, scope, query, embedding=None, version=None):
+        # Whether get() would return an answer, without counting a lookup or touching the LRU order
+        key = _key(scope, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._usable(key, entry, version):
+                return True
+            return embedding is not None and self._nearest(key, embedding, version) is not None
+
+    def get_fallback(self, scope, query, embedding=None, similarity_threshold=FALLBACK_SIMILARITY):
+        # Best effort answer while Gemini is down: ignores the TTL and the chapter version and
+        # accepts a less similar question. Nothing is evicted here.
+        key = _key(scope, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and embedding is not None:
+                candidates = [
+                    candidate_key for candidate_key, candidate in self._entries.items()
+                    if _comparable(candidate_key, key) and candidate.embedding is not None
+                ]
+                if candidates:
+                    similarities = np.stack([self._entries[candidate_key].embedding for candidate_key in candidates]) @ _unit(embedding)
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= similarity_threshold:
+                        entry = self._entries[candidates[best]]
+            if entry is None:
+                return None
+            self._counters["fallback_hits"] += 1
+            return entry.answer
+
+    def _nearest(self, query_key, embedding, version):
+        candidates = []
+        for key, entry in list(self._entries.items()):
+            if _comparable(key, query_key) and entry.embedding is not None and self._usable(key, entry, version):
+                candidates.append(key)
+        if not candidates:
+            return None
+
+        matrix = np.stack([self._entries[key].embedding for key in candidates])
+        similarities = matrix @ _unit(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return candidates[best]
+
+    def put(self, scope, query, answer, embedding=None, version=None):
+        key = _key(scope, query)
+        entry = _Entry(answer, _unit(embedding) if embedding is not None else None, version)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, scope=None):
+        # Drop the answers of one scope (e.g. after its chapter was re-ingested) or everything
+        with self._lock:
+            keys = [key for key in self._entries if scope is None or key[0] == scope]
+            for key in keys:
+                del self._entries[key]
+            self._counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def _comparable(key, other):
+    # Only questions of the same scope with the same numbers and symbols can share an answer
+    return key[0] == other[0] and key[2] == other[2]
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache()
+        return _default_cache
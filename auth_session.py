@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+import weakref
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+# Firebase Authentication over REST for account.py.
+# All calls share one pooled, keep-alive requests.Session, so after the first request logins
+# reuse an open TLS connection. The idToken/refreshToken pair returned at sign in is kept in an
+# AuthSession stored in st.session_state and refreshed in the background shortly before it
+# expires, so later reruns never have to sign in again.
+
+IDENTITY_TOOLKIT_URL = "https://identitytoolkit.googleapis.com/v1/accounts"
+SECURE_TOKEN_URL = "https://securetoken.googleapis.com/v1/token"
+
+# (connect, read) seconds
+TIMEOUT = (3.05, 10)
+POOL_SIZE = int(os.getenv("AUTH_HTTP_POOL_SIZE", "10"))
+# Tokens are refreshed this long before they expire (Firebase ID tokens live for an hour)
+REFRESH_MARGIN_SECONDS = 300
+# Comma separated emails or Firebase user ids (localId) allowed on the Diagnostics page; nobody
+# when unset. Display names are not used: anyone can pick any of them at sign up.
+ADMIN_USERS = {user.strip().lower() for user in os.getenv("EDURAG_ADMIN_USERS", "").split(",") if user.strip()}
+
+
+class AuthError(Exception):
+    pass
+
+
+# Built on first use. Kept here rather than in resources.py, which would pull chromadb and Gemini
+# into the login page.
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def _create_http_session():
+    session = requests.Session()
+    # Only failed connection attempts are retried; a POST that reached the server is not
+    # sent twice (a second signUp would fail with EMAIL_EXISTS)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = _create_http_session()
+    return _http_session
+
+
+def api_key():
+    return os.getenv('API_KEY')
+
+
+def post(url, data=None, json=None, **kwargs):
+    # POST to a Firebase REST endpoint with the project API key, on the shared session
+    return get_http_session().post(url, params={"key": api_key()}, data=data, json=json, timeout=TIMEOUT, **kwargs)
+
+
+def _error_message(response):
+    try:
+        return response.json().get('error', {}).get('message') or response.text
+    except ValueError:
+        return response.text
+
+
+class AuthSession:
+    def __init__(self, email, username, local_id, id_token, refresh_token, expires_in):
+        self.email = email
+        self.username = username
+        self.local_id = local_id
+        self._id_token = id_token
+        self._refresh_token = refresh_token
+        self.expires_at = time.time() + float(expires_in)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_sign_in(cls, data):
+        return cls(data['email'], data.get('displayName'), data.get('localId'), data['idToken'], data['refreshToken'], data.get('expiresIn', 3600))
+
+    def needs_refresh(self):
+        return time.time() >= self.expires_at - REFRESH_MARGIN_SECONDS
+
+    def refresh(self):
+        # Exchange the refresh token for a new ID token
+        with self._lock:
+            response = post(SECURE_TOKEN_URL, json={"grant_type": "refresh_token", "refresh_token": self._refresh_token})
+            if response.status_code != 200:
+                raise AuthError(_error_message(response))
+            data = response.json()
+            self._id_token = data['id_token']
+            self._refresh_token = data['refresh_token']
+            self.expires_at = time.time() + float(data.get('expires_in', 3600))
+
+    def id_token(self):
+        # A valid ID token, refreshed on the spot if the background refresh has not run yet
+        if self.needs_refresh():
+            self.refresh()
+        return self._id_token
+
+
+class TokenRefresher:
+    """Refreshes the tokens of every signed in session shortly before they expire.
+
+    Sessions are held weakly, so a browser session Streamlit has discarded is simply dropped.
+    """
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, auth):
+        with self._lock:
+            self._sessions.add(auth)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='auth-refresh', daemon=True)
+                self._thread.start()
+
+    def forget(self, auth):
+        with self._lock:
+            self._sessions.discard(auth)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                due = [auth for auth in self._sessions if auth.needs_refresh()]
+            for auth in due:
+                try:
+                    auth.refresh()
+                except Exception as e:
+                    # The user is asked to sign in again once the token actually expires
+                    print(f"Token refresh failed for {auth.email}: {e}")
+                    self.forget(auth)
+
+
+_refresher = TokenRefresher()
+
+
+def sign_in(email, password):
+    response = post(f"{IDENTITY_TOOLKIT_URL}:signInWithPassword", json={"email": email, "password": password, "returnSecureToken": True})
+    if response.status_code != 200:
+        raise AuthError(_error_message(response))
+    auth = AuthSession.from_sign_in(response.json())
+    _refresher.track(auth)
+    return auth
+
+
+def sign_out(auth):
+    if auth is not None:
+        _refresher.forget(auth)
+
+
+def is_admin(auth):
+    # auth is the signed in AuthSession, whose email and localId Firebase authenticated
+    if auth is None:
+        return False
+    return (auth.local_id or "").lower() in ADMIN_USERS or (auth.email or "").lower() in ADMIN_USERS
+
+
+def current(state):
+    # The signed in AuthSession kept in st.session_state, or None
+    auth = state.get('auth')
+    if auth is None:
+        return None
+    try:
+        auth.id_token()
+    except Exception as e:
+        print(f"Session for {auth.email} expired: {e}")
+        sign_out(auth)
+        state['auth'] = None
+        return None
+    return auth
@@ -0,0 +1,153 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from gemini_chatbot import NO_MATERIAL_ANSWER, collection_embedding_function, generate_answer, prepare_answer, prepare_chatbot, retrieve_context_batch
+
+# Answers a whole list of questions for one class/subject/chapter, e.g. every exercise question
+# of a chapter for a study guide:
+#   python batch_qa.py questions.jsonl --class 10 --subject Maths --chapter 1 --output answers.jsonl
+#   python batch_qa.py Book/Maths/chapter_1_real_numbers_q.pdf --subject Maths --chapter 1 --output answers.jsonl
+# The collection is opened once, all questions are embedded and retrieved in bulk, and only
+# generation runs per question, on a bounded pool of worker threads. Every answer is appended
+# to the output JSONL as soon as it is ready; running the command again skips the questions
+# that already have an answer there, so an interrupted run resumes where it stopped.
+
+DEFAULT_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "4"))
+
+
+def question_id(question, scope):
+    return hashlib.sha256(json.dumps([question, list(scope)]).encode("utf-8")).hexdigest()[:16]
+
+
+def read_questions(path):
+    # .jsonl: one {"question": ..., "id": optional} object per line; .pdf: the numbered questions
+    # of its EXERCISE blocks; anything else: one question per line
+    if path.endswith(".pdf"):
+        from chunker import extract_questions
+        from gemini_chatbot import load_pdf_pages
+
+        return [{"question": item["question"]} for item in extract_questions(load_pdf_pages(path), path, None)]
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line) if path.endswith(".jsonl") else {"question": line})
+    return questions
+
+
+def answered_ids(output_path):
+    # Ids of questions answered by an earlier run; failed ones are tried again
+    done = set()
+    if not output_path or not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A run killed mid-write can leave a partial last line
+                continue
+            if "answer" in record:
+                done.add(record["id"])
+    return done
+
+
+def answer_one(chroma_collection, item, query_embedding, candidates, where, scope, lexical_index):
+    started = time.perf_counter()
+    # Failures are reported instead of degraded, so a resumed run asks Gemini again
+    cached_answer, prompt, save, _ = prepare_answer(chroma_collection, item["question"], where=where, scope=scope, lexical_index=lexical_index, query_embedding=query_embedding, candidates=candidates)
+    if cached_answer is not None:
+        answer = cached_answer
+    else:
+        answer = generate_answer(prompt)
+        save(answer)
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "answer": answer,
+        "cached": cached_answer is not None and cached_answer != NO_MATERIAL_ANSWER,
+        "sources": sorted({candidate["metadata"].get("source") for candidate in candidates if candidate["metadata"].get("source")}),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def answer_questions(questions, class_selected, subject_selected, chapter_selected, output_path=None, concurrency=DEFAULT_CONCURRENCY, resume=True):
+    # Yields one result dict per question as answers complete (not in input order).
+    # questions are strings or {"question", "id"} dicts.
+    scope = (class_selected, subject_selected, chapter_selected)
+    items = []
+    for question in questions:
+        item = dict(question) if isinstance(question, dict) else {"question": question}
+        item.setdefault("id", question_id(item["question"], scope))
+        items.append(item)
+
+    done = answered_ids(output_path) if resume else set()
+    pending = [item for item in items if item["id"] not in done]
+    if not pending:
+        return
+
+    chroma_collection, where, scope, lexical_index = prepare_chatbot(class_selected, subject_selected, chapter_selected)
+    texts = [item["question"] for item in pending]
+    metrics.incr("batch_questions", len(pending))
+    # Gemini embeds up to EMBED_BATCH_SIZE texts per request, and every question is retrieved
+    # with one vector query
+    with metrics.span("batch_embed"):
+        query_embeddings = collection_embedding_function(chroma_collection)(texts)
+    with metrics.span("batch_retrieve"):
+        candidate_lists = retrieve_context_batch(texts, chroma_collection, query_embeddings, where=where, lexical_index=lexical_index)
+
+    output = open(output_path, "a", encoding="utf-8") if output_path else None
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-qa") as pool:
+            futures = {
+                pool.submit(answer_one, chroma_collection, item, query_embedding, candidates, where, scope, lexical_index): item
+                for item, query_embedding, candidates in zip(pending, query_embeddings, candidate_lists)
+            }
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error answering {item['id']}: {e}")
+                    result = {"id": item["id"], "question": item["question"], "error": str(e)}
+                if output is not None:
+                    output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    output.flush()
+                yield result
+    finally:
+        if output is not None:
+            output.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a list of questions for one chapter.")
+    parser.add_argument("questions", help="Questions as .jsonl, .txt (one per line) or an exercise .pdf")
+    parser.add_argument("--class", dest="class_selected", type=int, default=10)
+    parser.add_argument("--subject", required=True)
+    parser.add_argument("--chapter", type=int, required=True)
+    parser.add_argument("--output", required=True, help="JSONL file the answers are appended to")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Generation requests in flight at once")
+    parser.add_argument("--no-resume", action="store_true", help="Answer every question even if the output already has it")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    started = time.time()
+    answered = failed = 0
+    for result in answer_questions(questions, args.class_selected, args.subject, args.chapter, output_path=args.output, concurrency=args.concurrency, resume=not args.no_resume):
+        if "error" in result:
+            failed += 1
+        else:
+            answered += 1
+    elapsed = time.time() - started
+    print(f"Answered {answered}, failed {failed}, skipped {len(questions) - answered - failed} of {len(questions)} questions in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
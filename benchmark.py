@@ -0,0 +1,169 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import chromadb
+
+import bm25
+import chunker
+import context_packer
+import embedders
+import ingest
+import vector_store
+from index_admin import directory_size
+from gemini_chatbot import load_pdf_pages, make_rag_prompt, retrieve_candidates, split_text
+
+# Offline benchmark of the RAG pipeline against the PDFs in Book/Maths.
+# Gemini is replaced by deterministic local stand-ins (embeddings come from the local
+# backend in embedders.py) so runs are free, repeatable and comparable between commits:
+#   python benchmark.py                      # structure aware chunker (what ingest.py uses)
+#   python benchmark.py --chunker split_text # legacy 2000/200 character windows
+#   python benchmark.py --store matrix       # exact search store (vector_store.py) instead of Chroma
+#   python benchmark.py --json bench.json    # also write the report as JSON
+
+BENCH_BOOK_DIR = "Book/Maths"
+
+
+def stand_in_generate(prompt):
+    # Stand-in for generate_answer: echoes the first sentence of the context
+    context = prompt.split("Context:", 1)[-1].split("Question:", 1)[0].strip()
+    return context.split(". ", 1)[0]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run(book_dir=BENCH_BOOK_DIR, chunking="chunker", k=3, candidates=8, max_questions=None, store="chroma"):
+    work_dir = tempfile.mkdtemp(prefix="edurag-bench-")
+    try:
+        embedding_function = embedders.LocalEmbeddingFunction()
+        if store == "matrix":
+            collection = vector_store.MatrixStore(os.path.join(work_dir, "matrix"), "bench", embedding_function=embedding_function)
+            collection.create({"embedder": embedding_function.spec})
+        else:
+            client = chromadb.PersistentClient(path=os.path.join(work_dir, "chroma"))
+            collection = client.create_collection(name="bench", embedding_function=embedding_function)
+        lexical_index = bm25.BM25Index(os.path.join(work_dir, "bench.bm25.json"))
+
+        # Chunking, embedding, storing and the BM25 update all run through the same ingest.py
+        # functions as the app (content hash ids, stale chunk deletion, BM25 save per file)
+        def index(pages, source, pdf):
+            if chunking == "split_text":
+                texts = split_text("".join(pages), chunk_size=2000, overlap=200)
+                metadatas = [{"source": source, "class": ingest.DEFAULT_CLASS, "subject": pdf["subject"], "chapter": pdf["chapter"]} for _ in texts]
+                ids = [ingest.chunk_id(source, text) for text in texts]
+                return ingest.upsert_chunks(collection, source, ids, texts, metadatas, lexical_index)
+            return ingest.index_pages(pages, source, collection, ingest.DEFAULT_CLASS, pdf["subject"], pdf["chapter"], lexical_index)
+
+        timings = {"extract": 0.0, "index": 0.0}
+        pages_total = 0
+        chunks_total = 0
+        questions = []
+        extracted = []
+        for path in sorted(glob.glob(os.path.join(book_dir, "chapter_*.pdf"))):
+            pdf = ingest.describe_pdf(path)
+            source = ingest.source_key(path)
+
+            started = time.perf_counter()
+            pages = load_pdf_pages(path)
+            timings["extract"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            result = index(pages, source, pdf)
+            timings["index"] += time.perf_counter() - started
+
+            extracted.append((pages, source, pdf))
+            pages_total += len(pages)
+            chunks_total += result["chunks"]
+            if path.endswith("_q.pdf"):
+                questions.extend(chunker.extract_questions(pages, source, pdf["chapter"]))
+
+        # Indexing unchanged files again should find every chunk already stored
+        started = time.perf_counter()
+        reindexed = [index(pages, source, pdf) for pages, source, pdf in extracted]
+        reindex_seconds = time.perf_counter() - started
+
+        if max_questions:
+            questions = questions[:max_questions]
+
+        # Queries search the whole collection, so recall measures whether retrieval finds the
+        # right chapter at all. The exercise file a question was taken from does not count as
+        # a hit, otherwise every question would trivially retrieve itself.
+        latencies = []
+        prompt_tokens = []
+        hits = {"vector": 0, "hybrid": 0}
+        for item in questions:
+            for mode in ("vector", "hybrid"):
+                started = time.perf_counter()
+                query_embedding = embedding_function([item["question"]])[0]
+                results = retrieve_candidates(
+                    item["question"], collection, n_results=candidates, query_embedding=query_embedding,
+                    lexical_index=lexical_index if mode == "hybrid" else None,
+                )
+                passages = context_packer.pack_context(results, query_embedding=query_embedding)
+                prompt = make_rag_prompt(item["question"], relevant_passage="\n\n".join(passages))
+                stand_in_generate(prompt)
+                if mode == "hybrid":
+                    latencies.append(time.perf_counter() - started)
+                    prompt_tokens.append(chunker.count_tokens(prompt))
+
+                if any(r["metadata"]["chapter"] == item["chapter"] and r["metadata"]["source"] != item["source"] for r in results[:k]):
+                    hits[mode] += 1
+
+        ingest_seconds = sum(timings.values())
+        return {
+            "chunker": chunking,
+            "store": store,
+            "pdfs": len(glob.glob(os.path.join(book_dir, "chapter_*.pdf"))),
+            "pages": pages_total,
+            "chunks": chunks_total,
+            "ingest_seconds": round(ingest_seconds, 3),
+            "ingest_stage_seconds": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+            "pages_per_second": round(pages_total / ingest_seconds, 1) if ingest_seconds else 0.0,
+            "chunks_per_second": round(chunks_total / ingest_seconds, 1) if ingest_seconds else 0.0,
+            "reindex_seconds": round(reindex_seconds, 3),
+            "reindex_added": sum(result["added"] for result in reindexed),
+            "index_bytes": directory_size(work_dir),
+            "questions": len(questions),
+            "query_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 2),
+                "p95": round(percentile(latencies, 95) * 1000, 2),
+                "p99": round(percentile(latencies, 99) * 1000, 2),
+                "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            },
+            "mean_prompt_tokens": round(statistics.mean(prompt_tokens), 1) if prompt_tokens else 0.0,
+            f"recall@{k}": {mode: round(count / len(questions), 3) if questions else 0.0 for mode, count in hits.items()},
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingest, latency and retrieval quality benchmark.")
+    parser.add_argument("--book-dir", default=BENCH_BOOK_DIR)
+    parser.add_argument("--chunker", choices=["chunker", "split_text"], default="chunker")
+    parser.add_argument("--store", choices=["chroma", "matrix"], default="chroma", help="Vector store to benchmark")
+    parser.add_argument("--k", type=int, default=3, help="Cut-off for recall@k")
+    parser.add_argument("--max-questions", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(book_dir=args.book_dir, chunking=args.chunker, k=args.k, max_questions=args.max_questions, store=args.store)
+    print(json.dumps(report, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# Compact BM25 inverted index kept next to the Chroma collection. It stores term frequencies
+# and metadata per chunk, not the chunk text, which stays in Chroma.
+# One instance is shared by every session and ingest thread: reads and writes hold _lock, and a
+# reload builds the new postings aside and swaps them in at once.
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "in", "is", "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "when", "where", "which", "who", "why", "with",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    # Single letters are dropped (e.g. the "s" of "Euclid's") but single digits are kept
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if (len(token) > 1 or token.isdigit()) and token not in STOPWORDS]
+
+
+def matches_where(metadata, where):
+    # Evaluates the subset of Chroma `where` filters the app builds: equality, $eq/$ne/$in, $and, $or
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    # Merge several ranked id lists; ids ranked high in any list float to the top
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def _insert(docs, postings, doc_id, doc):
+    # Adds doc to the given dicts and returns its length
+    docs[doc_id] = doc
+    for term, count in doc["tf"].items():
+        postings.setdefault(term, {})[doc_id] = count
+    return doc["length"]
+
+
+class BM25Index:
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.mtime = None
+        # doc id -> {"tf": {term: count}, "length": tokens, "metadata": {...}}
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        index.reload_if_changed()
+        return index
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.mtime:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        docs = {}
+        postings = {}
+        total_length = 0
+        for doc_id, doc in data["docs"].items():
+            total_length += _insert(docs, postings, doc_id, doc)
+        with self._lock:
+            self.docs, self.postings, self.total_length = docs, postings, total_length
+            self.mtime = mtime
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"docs": self.docs}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.mtime = os.stat(self.path).st_mtime_ns
+
+    def _insert(self, doc_id, doc):
+        self.total_length += _insert(self.docs, self.postings, doc_id, doc)
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id)
+        self.total_length -= doc["length"]
+        for term in doc["tf"]:
+            posting = self.postings[term]
+            del posting[doc_id]
+            if not posting:
+                del self.postings[term]
+
+    def add(self, ids, texts, metadatas=None):
+        metadatas = metadatas or [{} for _ in ids]
+        docs = [(doc_id, tokenize(text), metadata) for doc_id, text, metadata in zip(ids, texts, metadatas)]
+        with self._lock:
+            for doc_id, tokens, metadata in docs:
+                if doc_id in self.docs:
+                    self._remove(doc_id)
+                self._insert(doc_id, {"tf": dict(Counter(tokens)), "length": len(tokens), "metadata": metadata or {}})
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            if ids is None:
+                ids = [doc_id for doc_id, doc in self.docs.items() if matches_where(doc["metadata"], where)]
+            for doc_id in ids:
+                if doc_id in self.docs:
+                    self._remove(doc_id)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def search(self, query, n_results=10, where=None):
+        # Returns [(doc_id, score)] sorted by descending BM25 score
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self.docs:
+                return []
+            doc_count = len(self.docs)
+            average_length = self.total_length / doc_count or 1.0
+            scores = Counter()
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, count in posting.items():
+                    length = self.docs[doc_id]["length"]
+                    scores[doc_id] += idf * count * (self.k1 + 1) / (count + self.k1 * (1 - self.b + self.b * length / average_length))
+
+            ranked = []
+            for doc_id, score in scores.most_common():
+                if matches_where(self.docs[doc_id]["metadata"], where):
+                    ranked.append((doc_id, score))
+                    if len(ranked) == n_results:
+                        break
+            return ranked
@@ -0,0 +1,294 @@
+import atexit
+import hashlib
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+# Chat history layout: one document per question/answer exchange under
+#   Chats/<username>/Exchanges/<exchange id>
+# instead of one ever-growing `Content` array in Chats/<username>, which hits Firestore's
+# 1 MiB document limit and has to be downloaded in full on every page load.
+
+CHATS = 'Chats'
+EXCHANGES = 'Exchanges'
+
+# Exchanges fetched per page and the most a page keeps rendered at once
+PAGE_SIZE = 10
+MAX_RENDERED = 50
+
+# Firestore allows at most 500 writes per batch
+_BATCH_LIMIT = 500
+
+# Outcomes of background writes remembered per process, oldest forgotten first
+STATUS_LIMIT = 1000
+
+# Background history reads run here so they overlap with answering the question
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chat-store')
+
+
+def exchanges_ref(db, username):
+    return db.collection(CHATS).document(username).collection(EXCHANGES)
+
+
+def new_exchange(db, username, question, answer, class_selected=None, subject_selected=None, chapter_selected=None):
+    # The document id is generated client side, so the exchange can be shown (and deleted)
+    # before it has been written
+    return {
+        'id': exchanges_ref(db, username).document().id,
+        'question': question,
+        'answer': answer,
+        'class': class_selected,
+        'subject': subject_selected,
+        'chapter': chapter_selected,
+        'created_at': datetime.now(timezone.utc),
+    }
+
+
+def _document_data(exchange):
+    data = {key: value for key, value in exchange.items() if key != 'id'}
+    data['created_at'] = firestore.SERVER_TIMESTAMP
+    return data
+
+
+def save_exchange(db, username, question, answer, class_selected=None, subject_selected=None, chapter_selected=None):
+    exchange = new_exchange(db, username, question, answer, class_selected, subject_selected, chapter_selected)
+    exchanges_ref(db, username).document(exchange['id']).set(_document_data(exchange))
+    return exchange['id']
+
+
+def load_page(db, username, cursor=None, page_size=PAGE_SIZE):
+    # Newest first. Returns (exchanges, next_cursor); next_cursor is None on the last page and
+    # otherwise is passed back in to fetch the following page.
+    query = exchanges_ref(db, username).order_by('created_at', direction=firestore.Query.DESCENDING)
+    if cursor is not None:
+        query = query.start_after(cursor)
+    snapshots = list(query.limit(page_size).stream())
+
+    exchanges = [dict(snapshot.to_dict(), id=snapshot.id) for snapshot in snapshots]
+    next_cursor = snapshots[-1] if len(snapshots) == page_size else None
+    return exchanges, next_cursor
+
+
+def delete_exchange(db, username, exchange_id):
+    exchanges_ref(db, username).document(exchange_id).delete()
+
+
+def migrate_legacy_chats(db, username):
+    # Move the old `Content` array of Chats/<username> into the Exchanges subcollection.
+    # Document ids are derived from the array position and content, so a migration that was
+    # interrupted can simply run again. Returns the number of exchanges migrated.
+    parent = db.collection(CHATS).document(username)
+    snapshot = parent.get()
+    if not snapshot.exists:
+        return 0
+    content = (snapshot.to_dict() or {}).get('Content')
+    if not content:
+        return 0
+
+    # The array has no timestamps; keep its order by spacing synthetic ones a second apart
+    # and ending just before the migration
+    base = time.time() - len(content)
+    rows = []
+    for position, chat in enumerate(content):
+        for question, answer in chat.items():
+            digest = hashlib.sha256(f"{position}\0{question}\0{answer}".encode('utf-8')).hexdigest()[:16]
+            rows.append((f"legacy-{position:06d}-{digest}", {
+                'question': question,
+                'answer': answer,
+                'class': None,
+                'subject': None,
+                'chapter': None,
+                'created_at': datetime.fromtimestamp(base + position, tz=timezone.utc),
+            }))
+
+    for start in range(0, len(rows), _BATCH_LIMIT):
+        batch = db.batch()
+        for exchange_id, data in rows[start:start + _BATCH_LIMIT]:
+            batch.set(exchanges_ref(db, username).document(exchange_id), data)
+        batch.commit()
+
+    parent.update({'Content': firestore.DELETE_FIELD, 'Username': username, 'Migrated': len(rows)})
+    return len(rows)
+
+
+def needs_history(state, username, key='chat_history'):
+    return state.get(f'{key}_user') != username
+
+
+def _first_page(db, username, migrate):
+    if migrate:
+        migrate_legacy_chats(db, username)
+    return load_page(db, username)
+
+
+def prefetch_history(state, db, username, key='chat_history'):
+    # Start reading the newest page in the background; pass the returned future to
+    # history_window(). Returns None when the window is already loaded.
+    if not needs_history(state, username, key):
+        return None
+    return _executor.submit(_first_page, db, username, not state.get(f'chats_migrated_{username}'))
+
+
+def history_window(state, db, username, key='chat_history', prefetched=None):
+    # Exchanges currently rendered for username, kept in `state` (st.session_state) across reruns
+    # so a rerun does not read anything from Firestore. The first call per user migrates the
+    # legacy array document and loads the newest page, or collects the prefetched one.
+    if needs_history(state, username, key):
+        if prefetched is not None:
+            exchanges, cursor = prefetched.result()
+        else:
+            exchanges, cursor = _first_page(db, username, not state.get(f'chats_migrated_{username}'))
+        state[f'chats_migrated_{username}'] = True
+        state[key] = exchanges
+        state[f'{key}_cursor'] = cursor
+        state[f'{key}_user'] = username
+    return state[key]
+
+
+def has_older(state, key='chat_history'):
+    return state.get(f'{key}_cursor') is not None
+
+
+def load_older(state, db, username, key='chat_history'):
+    # Append the next page, never keeping more than MAX_RENDERED exchanges rendered
+    exchanges, cursor = load_page(db, username, cursor=state.get(f'{key}_cursor'))
+    state[key] = (state[key] + exchanges)[:MAX_RENDERED]
+    state[f'{key}_cursor'] = cursor if len(state[key]) < MAX_RENDERED else None
+
+
+def reset_history(state, key='chat_history'):
+    # Forget the loaded window so the next history_window() call reads the newest page again
+    state[f'{key}_user'] = None
+
+
+def remember_exchange(state, username, exchange, keys=('chat_history', 'your_posts')):
+    # Read-after-write from local state: put a just-submitted exchange at the top of every
+    # loaded window instead of reading it back from Firestore
+    for key in keys:
+        if not needs_history(state, username, key) and not any(chat['id'] == exchange['id'] for chat in state[key]):
+            state[key] = ([exchange] + state[key])[:MAX_RENDERED]
+
+
+def forget_exchange(state, exchange_id, keys=('chat_history', 'your_posts')):
+    # Undo remember_exchange() for an exchange that could not be saved
+    for key in keys:
+        if key in state:
+            state[key] = [chat for chat in state[key] if chat['id'] != exchange_id]
+
+
+class WriteBehindWriter:
+    """Persists exchanges from a background thread so saving never delays the answer.
+
+    Queued exchanges are written in Firestore batches of up to batch_size, waiting at most
+    flush_interval seconds for a batch to fill. A failed batch is retried with jittered
+    exponential backoff; after max_retries it is dropped. status() reports whether an exchange
+    is still 'saving', was 'saved' or 'failed'.
+    """
+
+    def __init__(self, db, batch_size=20, flush_interval=0.25, max_retries=5, backoff=0.5):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._status = OrderedDict()
+        self._status_lock = threading.Lock()
+
+    def submit(self, username, exchange):
+        with self._status_lock:
+            self._set_status(exchange['id'], 'saving')
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+                self._thread.start()
+        self._queue.put((username, exchange))
+
+    def status(self, exchange_id):
+        # 'saving', 'saved', 'failed', or None for an exchange this writer no longer remembers
+        with self._status_lock:
+            return self._status.get(exchange_id)
+
+    def _set_status(self, exchange_id, status):
+        self._status[exchange_id] = status
+        self._status.move_to_end(exchange_id)
+        while len(self._status) > STATUS_LIMIT:
+            self._status.popitem(last=False)
+
+    def _finish(self, items, status):
+        with self._status_lock:
+            for _, exchange in items:
+                self._set_status(exchange['id'], status)
+
+    def flush(self, timeout=None):
+        # Wait until everything queued so far has been written (or given up on)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _write(self, items):
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = self.db.batch()
+                for username, exchange in items:
+                    # set() with the client generated id keeps retries idempotent
+                    batch.set(exchanges_ref(self.db, username).document(exchange['id']), _document_data(exchange))
+                batch.commit()
+                self._finish(items, 'saved')
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(items)
+                    print(f"Dropping {len(items)} chat exchanges after {attempt + 1} attempts: {e}")
+                    self._finish(items, 'failed')
+                    return
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db):
+    # One writer per Firestore client for the whole process
+    with _writers_lock:
+        writer = _writers.get(id(db))
+        if writer is None:
+            writer = _writers[id(db)] = WriteBehindWriter(db)
+        return writer
+
+
+@atexit.register
+def _flush_writers():
+    for writer in list(_writers.values()):
+        writer.flush(timeout=5)
@@ -0,0 +1,218 @@
+import re
+
+# Structure and token aware chunking for textbook pages.
+# Pages are split into sentences, grouped by paragraph and section, and packed into chunks
+# up to a token budget. Every chunk keeps its page range, section heading and character
+# offsets into the document formed by joining the pages with PAGE_SEPARATOR.
+
+PAGE_SEPARATOR = "\n\n"
+
+# Bumped whenever chunk boundaries change, so ingestion knows stored chunks are stale
+CHUNKER_VERSION = 1
+
+MAX_TOKENS = 512
+OVERLAP_TOKENS = 40
+# Fragments smaller than this (page headers, lone titles) are merged into the next section
+MIN_TOKENS = 50
+
+# Rough tokenizer estimate: words, numbers and individual symbols each count as one token,
+# which tracks subword tokenizers closely enough on maths text full of formulas
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Headings that start a new section, e.g. "1.2 Euclid's Division Lemma" or "EXERCISE 2.3"
+SECTION_HEADING = re.compile(r"^(?:\d+(?:\.\d+)+\s+[A-Z].{0,80}|(?:EXERCISE|Exercise)\s+\d+(?:\.\d+)*.{0,60})$")
+# Softer boundaries that start a new paragraph, e.g. "Q3 :" in the solution books or "Example 4"
+PARAGRAPH_HEADING = re.compile(r"^(?:Q\d+\s*:|Example\s+\d+|Theorem\s+\d+(?:\.\d+)*|Solution\s*:)")
+# The numbered questions of an exercise, e.g. "EXERCISE 1.2" followed by "3. Prove that ..."
+EXERCISE_HEADING = re.compile(r"^(?:EXERCISE|Exercise)\s+\d+(?:\.\d+)*", re.MULTILINE)
+QUESTION_START = re.compile(r"^\s*(\d+)\.\s+(\S.*)$")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z(\"'])")
+LINE = re.compile(r"[^\n]*\n?")
+
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def truncate_tokens(text, max_tokens):
+    # The longest prefix of text with at most max_tokens tokens
+    if max_tokens <= 0:
+        return ""
+    for i, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if i == max_tokens - 1:
+            return text[:match.end()]
+    return text
+
+
+class _Unit:
+    __slots__ = ("start", "end", "page", "tokens", "boundary", "section")
+
+    def __init__(self, start, end, page, tokens, boundary, section):
+        self.start = start
+        self.end = end
+        self.page = page
+        self.tokens = tokens
+        # None, "paragraph" or "section": the kind of break that precedes this unit
+        self.boundary = boundary
+        self.section = section
+
+
+def _sentence_units(text, offset, page, tokens_budget, boundary, section):
+    # Split a paragraph into sentences; anything longer than the budget is cut on whitespace
+    units = []
+    start = 0
+    pieces = [match.start() for match in SENTENCE_END.finditer(text)] + [len(text)]
+    for end in pieces:
+        sentence = text[start:end]
+        if sentence.strip():
+            tokens = count_tokens(sentence)
+            if tokens <= tokens_budget:
+                units.append(_Unit(offset + start, offset + end, page, tokens, boundary, section))
+            else:
+                units.extend(_window_units(sentence, offset + start, page, tokens_budget, boundary, section))
+            boundary = None
+        start = end
+    return units
+
+
+def _window_units(text, offset, page, tokens_budget, boundary, section):
+    units = []
+    words = list(re.finditer(r"\S+", text))
+    window_start = 0
+    while window_start < len(words):
+        window_end = window_start
+        tokens = 0
+        while window_end < len(words):
+            word_tokens = count_tokens(words[window_end].group())
+            if tokens and tokens + word_tokens > tokens_budget:
+                break
+            tokens += word_tokens
+            window_end += 1
+        units.append(_Unit(offset + words[window_start].start(), offset + words[window_end - 1].end(), page, tokens, boundary, section))
+        boundary = None
+        window_start = window_end
+    return units
+
+
+def _page_units(pages, max_tokens):
+    units = []
+    section = ""
+    offset = 0
+    for page_number, page in enumerate(pages, start=1):
+        paragraph_start = None
+        paragraph_boundary = "paragraph"
+        position = 0
+        for line in LINE.findall(page):
+            if not line:
+                break
+            stripped = line.strip()
+            heading = SECTION_HEADING.match(stripped) if stripped else None
+            soft_heading = PARAGRAPH_HEADING.match(stripped) if stripped else None
+
+            # A blank line or a heading closes the current paragraph
+            if paragraph_start is not None and (not stripped or heading or soft_heading):
+                units.extend(_sentence_units(page[paragraph_start:position], offset + paragraph_start, page_number, max_tokens, paragraph_boundary, section))
+                paragraph_start = None
+                paragraph_boundary = "paragraph"
+
+            if heading:
+                section = stripped[:80]
+                paragraph_boundary = "section"
+            if stripped and paragraph_start is None:
+                paragraph_start = position
+            position += len(line)
+
+        if paragraph_start is not None:
+            units.extend(_sentence_units(page[paragraph_start:position], offset + paragraph_start, page_number, max_tokens, paragraph_boundary, section))
+        offset += len(page) + len(PAGE_SEPARATOR)
+    return units
+
+
+def chunk_pages(pages, max_tokens=MAX_TOKENS, overlap_tokens=OVERLAP_TOKENS, min_tokens=MIN_TOKENS):
+    """Split extracted PDF pages into chunks of at most max_tokens estimated tokens.
+
+    Chunks never start mid-sentence, a new section starts a new chunk (unless the current one
+    is smaller than min_tokens), and a chunk
+    that is already three quarters full is closed at the next paragraph break. Consecutive
+    chunks of the same section share up to overlap_tokens of trailing sentences.
+    Returns a list of dicts with text, token count, page range, section and char offsets.
+    """
+    document = PAGE_SEPARATOR.join(pages)
+    chunks = []
+    current = []
+    tokens = 0
+    # Units in current that were carried over as overlap and are already part of a chunk
+    carried = 0
+
+    def flush(keep_overlap):
+        nonlocal current, tokens, carried
+        first, last = current[0], current[-1]
+        chunks.append({
+            "text": document[first.start:last.end].strip(),
+            "tokens": tokens,
+            "page_start": first.page,
+            "page_end": last.page,
+            "section": last.section,
+            "char_start": first.start,
+            "char_end": last.end,
+        })
+
+        overlap = []
+        overlap_size = 0
+        if keep_overlap:
+            for unit in reversed(current[1:]):
+                if overlap_size + unit.tokens > overlap_tokens:
+                    break
+                overlap.insert(0, unit)
+                overlap_size += unit.tokens
+        current, tokens, carried = overlap, overlap_size, len(overlap)
+
+    for unit in _page_units(pages, max_tokens):
+        if len(current) > carried:
+            if unit.boundary == "section" and tokens >= min_tokens:
+                flush(keep_overlap=False)
+            elif tokens + unit.tokens > max_tokens:
+                flush(keep_overlap=True)
+            elif unit.boundary == "paragraph" and tokens >= max_tokens * 0.75:
+                flush(keep_overlap=False)
+        elif unit.boundary == "section":
+            # Overlap never crosses into a new section
+            current, tokens, carried = [], 0, 0
+
+        # The carried overlap gives way if it would push this chunk over the budget
+        while carried and tokens + unit.tokens > max_tokens:
+            tokens -= current.pop(0).tokens
+            carried -= 1
+        current.append(unit)
+        tokens += unit.tokens
+
+    if len(current) > carried:
+        flush(keep_overlap=False)
+    return chunks
+
+
+def extract_questions(pages, source, chapter):
+    # Numbered questions of every EXERCISE block, labelled with the chapter they belong to
+    text = PAGE_SEPARATOR.join(pages)
+    questions = []
+    for heading in EXERCISE_HEADING.finditer(text):
+        current = None
+        for line in text[heading.end():].splitlines()[1:]:
+            stripped = line.strip()
+            match = QUESTION_START.match(stripped)
+            if match:
+                if current:
+                    questions.append(current)
+                current = match.group(2)
+            elif not stripped or SECTION_HEADING.match(stripped):
+                break
+            elif current is not None and len(current) < 400:
+                current += " " + stripped
+        if current:
+            questions.append(current)
+
+    return [
+        {"question": question[:400], "source": source, "chapter": chapter}
+        for question in dict.fromkeys(questions)
+        if len(question.split()) >= 5
+    ]
@@ -0,0 +1,260 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+import embedders
+import metrics
+import resources
+import vector_store
+
+# Keeps the vector and BM25 indexes of each (class, subject) open on demand, within a memory budget.
+#   EDURAG_INDEX_MEMORY_MB        estimated resident size of all open indexes; 0 means no limit
+#   EDURAG_PREWARM_COLLECTIONS    how many of the most used (class, subject) pairs to open at startup
+# Indexes are opened the first time a page asks for them. Every use moves the index to the
+# front of an LRU list. When the estimated total goes over the budget, the least recently used
+# indexes are closed. Usage counts are saved to USAGE_PATH so the next process knows which
+# indexes to prewarm.
+# The Chroma client gets the same budget as its own segment cache limit (resources.py). Closing a
+# collection here only drops its Python objects and BM25 index; Chroma unloads the HNSW segment itself.
+
+MEMORY_LIMIT_BYTES = resources.CHROMA_MEMORY_LIMIT_BYTES
+PREWARM_COLLECTIONS = int(os.getenv("EDURAG_PREWARM_COLLECTIONS", "0"))
+USAGE_PATH = "Books/RAG/collection_usage.json"
+# Usage counts are written back at most this often
+USAGE_SAVE_INTERVAL = 60.0
+
+# hnswlib stores every vector as float32 plus about 2*M neighbour links (M=16) and bookkeeping
+HNSW_OVERHEAD_BYTES = 200
+# Python dicts behind one BM25 term entry (document tf plus posting), measured with tracemalloc
+BM25_TERM_BYTES = 110
+
+
+def estimate_bytes(collection, lexical_index=None):
+    # Rough resident size of an open index, used to decide what to evict
+    count = collection.count()
+    dim = embedders.spec_dim(embedders.collection_spec(collection))
+    if isinstance(collection, vector_store.MatrixStore):
+        # The memory mapped matrix, paged in as it is queried
+        total = count * dim * np.dtype(collection.dtype).itemsize
+    else:
+        total = count * (dim * 4 + HNSW_OVERHEAD_BYTES)
+    if lexical_index is not None:
+        total += sum(len(doc["tf"]) for doc in lexical_index.docs.values()) * BM25_TERM_BYTES
+    return total
+
+
+class _Resident:
+    def __init__(self, collection, lexical_index, size):
+        self.collection = collection
+        self.lexical_index = lexical_index
+        self.size = size
+        self.opened_at = time.time()
+        self.hits = 0
+
+
+class CollectionManager:
+    """LRU of open indexes keyed by (class, subject).
+
+    open_index(class_selected, subject) returns (collection, lexical_index) and close_index(class_selected,
+    subject) releases whatever open_index cached elsewhere. open_index is called again on every hit,
+    so it should be cheap for an open index (gemini_chatbot.open_index is a resources lookup).
+    """
+
+    def __init__(self, open_index, close_index=None, memory_limit=MEMORY_LIMIT_BYTES, usage_path=USAGE_PATH):
+        self.open_index = open_index
+        self.close_index = close_index
+        self.memory_limit = memory_limit
+        self.usage_path = usage_path
+        self.usage = Counter(self._load_usage())
+        self.usage_saved_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Opening an index can take seconds; sessions asking for the same key wait for one open
+        self._key_locks = {}
+
+    def _load_usage(self):
+        if not self.usage_path or not os.path.exists(self.usage_path):
+            return {}
+        try:
+            with open(self.usage_path, "r", encoding="utf-8") as f:
+                return {tuple(json.loads(key)): count for key, count in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable collection usage file: {e}")
+            return {}
+
+    def save_usage(self):
+        if not self.usage_path:
+            return
+        with self._lock:
+            data = {json.dumps(list(key)): count for key, count in self.usage.items()}
+            self.usage_saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.usage_path) or ".", exist_ok=True)
+        tmp_path = self.usage_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.usage_path)
+
+    def get(self, class_selected, subject, count_usage=True):
+        # (collection, lexical_index) for the pair, opening it if it is not resident
+        key = (class_selected, subject)
+        with self._lock:
+            if count_usage:
+                self.usage[key] += 1
+            save_due = time.monotonic() - self.usage_saved_at >= USAGE_SAVE_INTERVAL
+            entry = self._hit(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if save_due:
+            self.save_usage()
+        if entry is not None:
+            return self._refresh(key, entry)
+
+        with key_lock:
+            with self._lock:
+                entry = self._hit(key)
+            if entry is not None:
+                return self._refresh(key, entry)
+            entry = self._open(key)
+        return entry.collection, entry.lexical_index
+
+    def _refresh(self, key, entry):
+        # Fetch a resident index through open_index again, so the resource health checks and the
+        # BM25 reload after an offline ingest run still apply
+        entry.collection, entry.lexical_index = self.open_index(*key)
+        return entry.collection, entry.lexical_index
+
+    def _hit(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.hits += 1
+        metrics.incr("collection_hits")
+        return entry
+
+    def _open(self, key):
+        with metrics.span("collection_open"):
+            collection, lexical_index = self.open_index(*key)
+            entry = _Resident(collection, lexical_index, estimate_bytes(collection, lexical_index))
+        metrics.incr("collection_misses")
+        metrics.observe("collection_bytes", entry.size)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            evicted = self._over_limit(keep=key)
+        for evicted_key in evicted:
+            self._close(evicted_key)
+        return entry
+
+    def _over_limit(self, keep):
+        # Pops least recently used entries until the rest fit; the entry just opened always stays
+        evicted = []
+        if not self.memory_limit:
+            return evicted
+        while self._resident_bytes() > self.memory_limit and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            del self._entries[key]
+            evicted.append(key)
+            self.evictions += 1
+        return evicted
+
+    def _close(self, key):
+        metrics.incr("collection_evictions")
+        print(f"Closing index for class {key[0]} {key[1]} to stay under the memory limit")
+        if self.close_index is not None:
+            self.close_index(*key)
+
+    def evict(self, class_selected, subject):
+        key = (class_selected, subject)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._close(key)
+
+    def _resident_bytes(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def resident_bytes(self):
+        with self._lock:
+            return self._resident_bytes()
+
+    def most_used(self, n):
+        with self._lock:
+            return [key for key, _ in self.usage.most_common(n)]
+
+    def prewarm(self, keys):
+        # Open the given pairs, most important first; stops once the budget is full so
+        # prewarming never evicts an index it opened itself
+        for key in keys:
+            if self.memory_limit and self.resident_bytes() >= self.memory_limit:
+                break
+            try:
+                self.get(*key, count_usage=False)
+            except Exception as e:
+                print(f"Error prewarming index for class {key[0]} {key[1]}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_limit_bytes": self.memory_limit,
+                "resident_bytes": self._resident_bytes(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident": [
+                    {"class": key[0], "subject": key[1], "bytes": entry.size, "hits": entry.hits, "opened_at": entry.opened_at}
+                    for key, entry in reversed(self._entries.items())
+                ],
+            }
+
+
+def _create_manager():
+    from gemini_chatbot import close_index, open_index
+
+    manager = CollectionManager(open_index, close_index)
+    atexit.register(manager.save_usage)
+    return manager
+
+
+def get_manager():
+    return resources.get_resource(("collection_manager",), _create_manager)
+
+
+def get_index(class_selected, subject):
+    return get_manager().get(class_selected, subject)
+
+
+def _prewarm(n):
+    from gemini_chatbot import COLLECTION_LAYOUT
+
+    # The shared layout has a single collection, opened by the first question anyway
+    if COLLECTION_LAYOUT != "per_subject":
+        return
+    manager = get_manager()
+    started = time.perf_counter()
+    keys = manager.most_used(n)
+    manager.prewarm(keys)
+    print(f"Prewarmed {len(keys)} indexes in {time.perf_counter() - started:.1f}s")
+
+
+def start_prewarm(n=PREWARM_COLLECTIONS):
+    # Called on every page run; opens the n most used indexes once per process, in the background
+    if n <= 0:
+        return
+
+    def start():
+        thread = threading.Thread(target=_prewarm, args=(n,), name="collection-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    resources.get_resource(("collection_prewarm",), start)
@@ -0,0 +1,163 @@
+import os
+import re
+
+import numpy as np
+
+import chunker
+
+# Turns retrieved chunks into the context of the RAG prompt:
+# 1. merge chunks of the same source that touch or overlap, removing the repeated text,
+# 2. drop near-duplicate passages,
+# 3. order what is left by maximal marginal relevance (relevant, but not redundant),
+# 4. keep passages until the token budget is spent.
+# Candidates are dicts with "id", "text", "metadata" and optionally "embedding".
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+DUPLICATE_THRESHOLD = 0.8
+MMR_LAMBDA = 0.7
+
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _join_overlapping(first, second):
+    # Append second to first, dropping the prefix of second that first already ends with
+    probe = second[:40]
+    position = first.rfind(probe) if probe else -1
+    while position >= 0:
+        if second.startswith(first[position:]):
+            return first[:position] + second
+        position = first.rfind(probe, 0, position)
+    return first + "\n" + second
+
+
+def merge_adjacent(candidates):
+    # Chunks of one source whose character ranges touch or overlap become a single passage
+    merged = []
+    by_source = {}
+    for candidate in candidates:
+        metadata = candidate.get("metadata") or {}
+        if "char_start" not in metadata or "source" not in metadata:
+            merged.append(candidate)
+            continue
+        by_source.setdefault(metadata["source"], []).append(candidate)
+
+    for group in by_source.values():
+        group.sort(key=lambda candidate: candidate["metadata"]["char_start"])
+        current = group[0]
+        for candidate in group[1:]:
+            # Page separators sit between chunks of consecutive pages, so allow a small gap
+            if candidate["metadata"]["char_start"] <= current["metadata"]["char_end"] + len(chunker.PAGE_SEPARATOR) + 2:
+                current = _merge_pair(current, candidate)
+            else:
+                merged.append(current)
+                current = candidate
+        merged.append(current)
+
+    # Keep the retrieval order: a merged passage ranks where its best chunk ranked
+    merged.sort(key=lambda candidate: candidate["rank"])
+    return merged
+
+
+def _merge_pair(first, second):
+    metadata = dict(first["metadata"])
+    metadata["char_end"] = max(first["metadata"]["char_end"], second["metadata"]["char_end"])
+    if "page_end" in second["metadata"]:
+        metadata["page_end"] = max(metadata.get("page_end", 0), second["metadata"]["page_end"])
+
+    embedding = None
+    if first.get("embedding") is not None and second.get("embedding") is not None:
+        embedding = _unit(_unit(first["embedding"]) + _unit(second["embedding"]))
+    return {
+        "id": first["id"],
+        "text": _join_overlapping(first["text"], second["text"]),
+        "metadata": metadata,
+        "embedding": embedding,
+        "rank": min(first["rank"], second["rank"]),
+    }
+
+
+def drop_near_duplicates(candidates, threshold=DUPLICATE_THRESHOLD):
+    kept = []
+    kept_shingles = []
+    for candidate in candidates:
+        shingles = _shingles(candidate["text"])
+        if any(jaccard(shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(candidate)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def mmr_order(candidates, query_embedding=None, lambda_=MMR_LAMBDA):
+    # Greedy maximal marginal relevance. Uses embedding cosine similarity when every candidate
+    # has an embedding, otherwise falls back to the retrieval rank and word shingle overlap.
+    if len(candidates) < 2:
+        return list(candidates)
+
+    if query_embedding is not None and all(candidate.get("embedding") is not None for candidate in candidates):
+        matrix = np.stack([_unit(candidate["embedding"]) for candidate in candidates])
+        relevance = matrix @ _unit(query_embedding)
+        similarity = matrix @ matrix.T
+    else:
+        relevance = np.array([1.0 / (candidate["rank"] + 1) for candidate in candidates])
+        shingles = [_shingles(candidate["text"]) for candidate in candidates]
+        similarity = np.array([[jaccard(a, b) for b in shingles] for a in shingles])
+
+    selected = []
+    remaining = list(range(len(candidates)))
+    while remaining:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_ * relevance[remaining] - (1 - lambda_) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return [candidates[i] for i in selected]
+
+
+def pack(candidates, token_budget=TOKEN_BUDGET):
+    # Keep passages in order while they fit; a passage that does not fit is skipped so a
+    # shorter one further down can still use the remaining budget
+    packed = []
+    used = 0
+    for candidate in candidates:
+        tokens = chunker.count_tokens(candidate["text"])
+        if used + tokens > token_budget:
+            continue
+        packed.append(candidate)
+        used += tokens
+    return packed
+
+
+def pack_context(candidates, query_embedding=None, token_budget=TOKEN_BUDGET):
+    # Returns the passage texts to put into the prompt, most useful first
+    candidates = [dict(candidate, rank=candidate.get("rank", i)) for i, candidate in enumerate(candidates)]
+    candidates = merge_adjacent(candidates)
+    candidates = drop_near_duplicates(candidates)
+    candidates = mmr_order(candidates, query_embedding)
+    packed = pack(candidates, token_budget)
+    if not packed and candidates:
+        # Never send an empty context just because the best passage alone is over budget
+        packed = [dict(candidates[0], text=chunker.truncate_tokens(candidates[0]["text"], token_budget))]
+    return [candidate["text"] for candidate in packed]
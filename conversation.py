@@ -0,0 +1,186 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import chunker
+import metrics
+
+# Per-session conversation memory for the chatbot page, kept in st.session_state.
+# Instead of replaying the whole history, a question sees
+#   - a rolling summary of the older turns, folded forward SUMMARY_EVERY turns at a time on a
+#     background thread, so summarising never delays an answer, and
+#   - the most recent exchanges verbatim,
+# both trimmed to HISTORY_TOKEN_BUDGET. Follow-up questions ("why is it prime?") are rewritten
+# into standalone questions before retrieval, and gemini_chatbot.build_prompt() holds the whole
+# prompt under PROMPT_TOKEN_CEILING, so a turn costs the same however long the session runs.
+
+PROMPT_TOKEN_CEILING = int(os.getenv("PROMPT_TOKEN_CEILING", "2000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "400"))
+# Exchanges kept verbatim and how many older ones are folded into the summary at once
+RECENT_TURNS = 3
+SUMMARY_EVERY = 3
+# If summarising keeps failing, the oldest raw exchanges are dropped beyond this
+MAX_RAW_TURNS = RECENT_TURNS + 3 * SUMMARY_EVERY
+SUMMARY_TOKENS = 200
+# Cap on each question or answer as it appears in the history
+TURN_TOKENS = 150
+REWRITE_HISTORY_TOKENS = 300
+REWRITE_MAX_TOKENS = 64
+
+# Questions this short, or leaning on the conversation through words like these, are rewritten
+SHORT_QUESTION_WORDS = 4
+FOLLOW_UP = re.compile(
+    # "that" is left out: "prove that ..." starts half the maths questions
+    r"\b(it|its|this|these|those|they|them|their|he|she|him|her|above|previous|same|again|"
+    r"another|what about|how about|and why|explain more|tell me more)\b",
+    re.IGNORECASE,
+)
+
+# Summaries are written here, off the request path
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='conversation')
+
+
+def refers_back(question):
+    # Leans on the conversation through a pronoun or phrase like "what about"
+    return FOLLOW_UP.search(question) is not None
+
+
+def is_follow_up(question):
+    return len(question.split()) <= SHORT_QUESTION_WORDS or refers_back(question)
+
+
+def _format_turn(question, answer):
+    return f"Student: {chunker.truncate_tokens(question, TURN_TOKENS)}\nTutor: {chunker.truncate_tokens(answer, TURN_TOKENS)}"
+
+
+def make_summary_prompt(summary, turns):
+    exchanges = "\n\n".join(_format_turn(question, answer) for question, answer in turns)
+    return ("""Update the summary of a tutoring conversation with the new exchanges below.
+        Keep the topics, definitions and results the student asked about, and what they found
+        difficult. Write at most {words} words of plain text.\n\n
+        Current summary:\n{summary}\n
+        New exchanges:\n{exchanges}\n
+        Updated summary:""").format(words=SUMMARY_TOKENS * 3 // 4, summary=summary or "(none)", exchanges=exchanges)
+
+
+def make_rewrite_prompt(history_text, question):
+    return ("""Rewrite the student's follow-up question as a standalone question that can be
+        understood without the conversation. Name the topic it refers to and keep its meaning.
+        Return only the rewritten question.\n\n
+        Conversation:\n{history}\n
+        Follow-up question: {question}\n
+        Standalone question:""").format(history=history_text, question=question)
+
+
+class Conversation:
+    def __init__(self):
+        self.summary = ""
+        # (question, answer) pairs not yet folded into the summary, oldest first
+        self.turns = []
+        self.summarized_turns = 0
+        self._summarizing = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.summarized_turns + len(self.turns)
+
+    def render(self, token_budget=HISTORY_TOKEN_BUDGET):
+        # The summary and as many of the newest exchanges as fit in token_budget tokens
+        with self._lock:
+            summary = self.summary
+            turns = self.turns[-(RECENT_TURNS + SUMMARY_EVERY):]
+        parts = []
+        used = 0
+        if summary:
+            text = "Earlier in this conversation: " + chunker.truncate_tokens(summary, token_budget)
+            used = chunker.count_tokens(text)
+            parts.append(text)
+        recent = []
+        for question, answer in reversed(turns):
+            text = _format_turn(question, answer)
+            tokens = chunker.count_tokens(text)
+            if used + tokens > token_budget:
+                break
+            recent.append(text)
+            used += tokens
+        return "\n\n".join(parts + recent[::-1])
+
+    def needs_rewrite(self, question):
+        # First questions are never rewritten, there is nothing to fill in
+        return len(self) > 0 and is_follow_up(question)
+
+    def standalone_query(self, question):
+        # The question to retrieve and answer with: unchanged for a first or self-contained
+        # question, otherwise rewritten by Gemini with the conversation filled in
+        if not self.needs_rewrite(question):
+            return question
+        from gemini_chatbot import generate_answer
+
+        history_text = self.render(REWRITE_HISTORY_TOKENS)
+        try:
+            with metrics.span("rewrite_query"):
+                rewritten = generate_answer(make_rewrite_prompt(history_text, question))
+        except Exception as e:
+            # Retrieval still gets a hint of the topic from the previous question
+            print(f"Error rewriting follow-up question: {e}")
+            metrics.incr("query_rewrite_failures")
+            with self._lock:
+                previous = self.turns[-1][0] if self.turns else ""
+            return f"{chunker.truncate_tokens(previous, TURN_TOKENS)} {question}".strip()
+        metrics.incr("query_rewrites")
+        rewritten = chunker.truncate_tokens(rewritten.strip().strip('"'), REWRITE_MAX_TOKENS)
+        return rewritten or question
+
+    def add_turn(self, question, answer):
+        with self._lock:
+            self.turns.append((question, answer))
+            if len(self.turns) > MAX_RAW_TURNS:
+                del self.turns[:len(self.turns) - MAX_RAW_TURNS]
+            if self._summarizing or len(self.turns) < RECENT_TURNS + SUMMARY_EVERY:
+                return
+            self._summarizing = True
+            folding = self.turns[:SUMMARY_EVERY]
+            summary = self.summary
+        _executor.submit(self._summarize, summary, folding)
+
+    def _summarize(self, summary, folding):
+        # Fold the oldest raw exchanges into the summary
+        from gemini_chatbot import generate_answer
+
+        try:
+            with metrics.span("summarize_conversation"):
+                updated = generate_answer(make_summary_prompt(summary, folding))
+        except Exception as e:
+            # The exchanges stay verbatim and are folded after the next turn
+            print(f"Error summarising conversation: {e}")
+            metrics.incr("conversation_summary_failures")
+            with self._lock:
+                self._summarizing = False
+            return
+        with self._lock:
+            self.summary = chunker.truncate_tokens(updated.strip(), SUMMARY_TOKENS)
+            # Some of them may already have been dropped for exceeding MAX_RAW_TURNS
+            folded = [turn for turn in self.turns[:len(folding)] if any(turn is other for other in folding)]
+            del self.turns[:len(folded)]
+            self.summarized_turns += len(folding)
+            self._summarizing = False
+        metrics.incr("conversation_summaries")
+
+
+def get_conversation(state, username, scope):
+    # One conversation per user and class/subject/chapter, kept in `state` (st.session_state)
+    conversations = state.setdefault('conversations', {})
+    key = (username, tuple(scope))
+    if key not in conversations:
+        conversations[key] = Conversation()
+    return conversations[key]
+
+
+def reset(state, username, scope):
+    state.setdefault('conversations', {}).pop((username, tuple(scope)), None)
+
+
+def forget(state):
+    # Drop every conversation of the session, e.g. on sign out
+    state['conversations'] = {}
@@ -1,7 +1,7 @@
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-def get_google_api_key():
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+def get_google_api_key():
     return os.getenv("GOOGLE_API_KEY")
\ No newline at end of file
@@ -0,0 +1,79 @@
+import streamlit as st
+
+import answer_cache
+import auth_session
+import collection_manager
+import embedding_cache
+import gemini_client
+import metrics
+import resources
+
+
+def app():
+    st.title('Diagnostics')
+
+    # Closed unless EDURAG_ADMIN_USERS lists the email or user id of the signed in user
+    if not auth_session.is_admin(auth_session.current(st.session_state)):
+        st.warning('This page is only available to administrators.')
+        return
+
+    if not metrics.ENABLED:
+        st.info('Metrics are disabled. Start the app with EDURAG_METRICS=1 to collect them.')
+        return
+
+    data = metrics.snapshot()
+
+    st.header('Stage latency (seconds)')
+    stages = [
+        {"stage": h["labels"].get("stage", ""), "count": h["count"], "p50": h["p50"], "p95": h["p95"], "p99": h["p99"], "max": h["max"]}
+        for h in data["histograms"] if h["name"] == "stage_seconds"
+    ]
+    if stages:
+        st.table(stages)
+    else:
+        st.text('No requests recorded yet.')
+
+    st.header('Distributions')
+    others = [
+        {"metric": h["name"], "count": h["count"], "p50": h["p50"], "p95": h["p95"], "p99": h["p99"], "max": h["max"]}
+        for h in data["histograms"] if h["name"] != "stage_seconds"
+    ]
+    if others:
+        st.table(others)
+
+    st.header('Counters')
+    if data["counters"]:
+        st.table([{"counter": c["name"], "labels": str(c["labels"] or ""), "value": c["value"]} for c in data["counters"]])
+
+    st.header('Caches')
+    st.json({
+        "answer_cache": answer_cache.get_default_cache().stats(),
+        "embedding_cache": embedding_cache.get_default_cache().stats(),
+        "resources": resources.stats(),
+    })
+
+    st.header('Indexes')
+    indexes = collection_manager.get_manager().stats()
+    st.json({key: value for key, value in indexes.items() if key != "resident"})
+    if indexes["resident"]:
+        st.table(indexes["resident"])
+    else:
+        st.text('No per-subject indexes open. They are used with EDURAG_COLLECTION_LAYOUT=per_subject.')
+
+    st.header('Gemini clients')
+    clients = gemini_client.stats()
+    if clients:
+        st.table(clients)
+    else:
+        st.text('No Gemini calls made yet.')
+
+    st.header('Export')
+    st.download_button('Download JSON', metrics.to_json(), file_name='edurag_metrics.json', mime='application/json')
+    prometheus_text = metrics.to_prometheus()
+    st.download_button('Download Prometheus text', prometheus_text, file_name='edurag_metrics.prom', mime='text/plain')
+    with st.expander('Prometheus text'):
+        st.code(prometheus_text)
+
+    if st.button('Reset metrics'):
+        metrics.reset()
+        st.success('Metrics reset.')
@@ -0,0 +1,93 @@
+import os
+import zlib
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+import bm25
+
+# Embedding backends a collection can be indexed with. A collection records its backend as an
+# "embedder" spec string in its Chroma metadata and is always queried with that same backend:
+#   gemini:<model>              GeminiEmbeddingFunction (gemini_chatbot.py), over the network
+#   local:hash-v1:<dim>         LocalEmbeddingFunction below, NumPy only, no network
+# Collections created before specs were recorded carry no metadata and were built with Gemini.
+GEMINI = "gemini"
+LOCAL = "local"
+LOCAL_VERSION = "hash-v1"
+LOCAL_DIM = int(os.getenv("EDURAG_LOCAL_EMBEDDING_DIM", "512"))
+LEGACY_SPEC = "gemini:models/embedding-001"
+# Size of the vectors returned by the Gemini embedding models used here
+GEMINI_DIM = 768
+
+# Backend used for new collections ("gemini" or "local"). When set explicitly, opening a
+# collection that was indexed with the other backend is an error instead of a silent switch.
+EMBEDDER = os.getenv("EDURAG_EMBEDDER")
+
+
+class LocalEmbeddingFunction(EmbeddingFunction):
+    # Signed feature hashing of words and word bigrams with sublinear term frequency.
+    # A whole batch is hashed into flat index arrays and scattered into one matrix at once,
+    # so re-indexing runs at CPU speed and query latency does not depend on any API.
+    def __init__(self, dim=LOCAL_DIM):
+        self.dim = dim
+
+    @property
+    def spec(self):
+        return f"{LOCAL}:{LOCAL_VERSION}:{self.dim}"
+
+    def __call__(self, input: Documents) -> Embeddings:
+        rows = []
+        features = []
+        for row, text in enumerate(input):
+            words = bm25.tokenize(text)
+            grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            features.extend(grams)
+            rows.extend([row] * len(grams))
+
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+        vectors = np.zeros((len(input), self.dim), dtype=np.float32)
+        np.add.at(vectors, (np.asarray(rows, dtype=np.intp), (hashes % self.dim).astype(np.intp)), signs)
+
+        # Dampen repeated terms, then L2 normalise so distances behave like cosine
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+def default_spec(gemini_model):
+    # Spec for a collection created now
+    if EMBEDDER == LOCAL:
+        return LocalEmbeddingFunction().spec
+    if EMBEDDER not in (None, GEMINI):
+        raise ValueError(f"Unknown EDURAG_EMBEDDER {EMBEDDER!r}, expected {GEMINI!r} or {LOCAL!r}")
+    return f"{GEMINI}:{gemini_model}"
+
+
+def collection_spec(collection):
+    return (collection.metadata or {}).get("embedder", LEGACY_SPEC)
+
+
+def check_compatible(name, spec):
+    # A collection must never be queried with vectors from a different embedder
+    backend = spec.split(":", 1)[0]
+    if backend not in (GEMINI, LOCAL):
+        raise ValueError(f"Collection '{name}' was indexed with unsupported embedder {spec!r}")
+    if EMBEDDER is not None and EMBEDDER != backend:
+        raise ValueError(f"Collection '{name}' was indexed with {spec!r} but EDURAG_EMBEDDER={EMBEDDER!r}. "
+                         f"Index into another collection (EDURAG_COLLECTION) or unset EDURAG_EMBEDDER.")
+
+
+def spec_dim(spec):
+    # Embedding dimension of a spec
+    if spec.startswith(LOCAL + ":"):
+        return int(spec.rsplit(":", 1)[1])
+    return GEMINI_DIM
+
+
+def local_from_spec(spec):
+    _, version, dim = spec.split(":")
+    if version != LOCAL_VERSION:
+        raise ValueError(f"Local embedder version {version!r} is not supported by this build (expected {LOCAL_VERSION!r})")
+    return LocalEmbeddingFunction(dim=int(dim))
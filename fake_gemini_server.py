@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Gemini REST API, for exercising gemini_client.py without quota:
+#   python fake_gemini_server.py --port 8765 --fail-rate 0.2 --latency 0.3
+#   GEMINI_API_ENDPOINT=http://127.0.0.1:8765 streamlit run main.py
+# Implements generateContent, streamGenerateContent, embedContent and batchEmbedContents.
+# Answers echo the start of the prompt's context; embeddings are deterministic hashes of the text.
+# Failures are injected as 429 (rate limit) or 503 responses at the configured rates, and
+# --max-concurrent makes the server answer 429 while too many requests are in flight.
+
+ROUTE = re.compile(r"^/v1beta/models/(?P<model>[^:/]+):(?P<method>\w+)")
+EMBEDDING_DIM = 768
+
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+    values = [random.Random(seed + i).uniform(-1.0, 1.0) for i in range(dim)]
+    norm = sum(value * value for value in values) ** 0.5
+    return [value / norm for value in values]
+
+
+def fake_answer(prompt):
+    context = prompt.split("Context:", 1)[-1].split("Question:", 1)[0].strip()
+    return (context[:300] or "answer is not available in the context")
+
+
+def prompt_text(body):
+    return " ".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+
+
+def generate_response(text, finish=True):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate]}
+
+
+class FakeGemini:
+    def __init__(self, latency=0.0, fail_rate=0.0, throttle_rate=0.0, max_concurrent=None, seed=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.max_concurrent = max_concurrent
+        self.random = random.Random(seed)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = {429: 0, 503: 0}
+        self.lock = threading.Lock()
+
+    def admit(self):
+        # Returns an HTTP error status to inject, or None to serve the request
+        with self.lock:
+            self.requests += 1
+            roll = self.random.random()
+            if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+                status = 429
+            elif roll < self.throttle_rate:
+                status = 429
+            elif roll < self.throttle_rate + self.fail_rate:
+                status = 503
+            else:
+                self.in_flight += 1
+                return None
+            self.errors[status] += 1
+            return status
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "in_flight": self.in_flight, "errors": dict(self.errors)}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                self.send_json(200, fake.stats())
+            else:
+                self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            match = ROUTE.match(self.path)
+            if not match:
+                self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                return
+
+            status = fake.admit()
+            if status is not None:
+                message = "Resource has been exhausted (e.g. check quota)." if status == 429 else "The service is currently unavailable."
+                self.send_json(status, {"error": {"code": status, "message": message, "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}})
+                return
+            try:
+                time.sleep(fake.latency)
+                method = match.group("method")
+                if method == "generateContent":
+                    self.send_json(200, generate_response(fake_answer(prompt_text(body))))
+                elif method == "streamGenerateContent":
+                    self.stream(fake_answer(prompt_text(body)))
+                elif method == "embedContent":
+                    self.send_json(200, {"embedding": {"values": fake_embedding(prompt_text({"contents": [body.get("content", {})]}))}})
+                elif method == "batchEmbedContents":
+                    self.send_json(200, {"embeddings": [
+                        {"values": fake_embedding(prompt_text({"contents": [request.get("content", {})]}))}
+                        for request in body.get("requests", [])
+                    ]})
+                else:
+                    self.send_json(404, {"error": {"code": 404, "message": f"Unknown method {method}", "status": "NOT_FOUND"}})
+            finally:
+                fake.done()
+
+        def stream(self, text):
+            # The REST transport reads a JSON array of responses, one per chunk
+            words = text.split(" ")
+            pieces = [" ".join(words[i:i + 8]) + " " for i in range(0, len(words), 8)] or [""]
+            chunks = [generate_response(piece, finish=i == len(pieces) - 1) for i, piece in enumerate(pieces)]
+            data = ("[" + ",\r\n".join(json.dumps(chunk) for chunk in chunks) + "]").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8765, **options):
+    # Returns (server, fake); call server.serve_forever() or run it in a thread
+    fake = FakeGemini(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini REST server with injectable failures.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every served request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="Answer 429 above this many requests in flight")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server, _ = serve(args.host, args.port, latency=args.latency, fail_rate=args.fail_rate, throttle_rate=args.throttle_rate, max_concurrent=args.max_concurrent, seed=args.seed)
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import os
+import threading
+
+import firebase_admin
+from firebase_admin import credentials
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_lock = threading.Lock()
+
+
+def ensure_firebase():
+    # Initialise the default Firebase app once per process. Safe to call on every rerun and
+    # from every page that needs Firestore; later calls return the existing app.
+    with _lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(os.getenv('FIREBASE_CERT_PATH'))
+            return firebase_admin.initialize_app(cred)
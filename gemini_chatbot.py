@@ -1,148 +1,574 @@
-import os
-import re
-from pypdf import PdfReader
-import chromadb
-from chromadb import Documents, EmbeddingFunction, Embeddings
-import google.generativeai as genai
-import db  # Import db for fetching the API key
-
-# Get Google API key from db.py
-google_api_key = db.get_google_api_key()
-
-class GeminiEmbeddingFunction(EmbeddingFunction):
-    def __call__(self, input: Documents) -> Embeddings:
-        if not google_api_key:
-            raise ValueError("Google API Key not provided. Please provide it via db.get_google_api_key()")
-        
-        # print(f"Embedding input: {input}")
-        genai.configure(api_key=google_api_key)
-        model = "models/embedding-001"
-        title = "Custom query"
-        
-        try:
-            embedding_result = genai.embed_content(model=model, content=input, task_type="retrieval_document", title=title)["embedding"]
-            # print("Embedding successfully generated.")
-        except Exception as e:
-            print(f"Error in generating embeddings: {e}")
-            raise e
-        
-        return embedding_result
-
-def load_pdf(file_path):
-    # print(f"Loading PDF from: {file_path}")
-    reader = PdfReader(file_path)
-    text = "".join([page.extract_text() for page in reader.pages])
-    # print("PDF loaded successfully and text extracted.")
-    return text
-
-def split_text(text, chunk_size=2000, overlap=200):
-    chunks = []
-    start = 0
-    
-    while start < len(text):
-        end = min(start + chunk_size, len(text))  # Ensure we don't go beyond the length of the text
-        chunks.append(text[start:end])
-        start += chunk_size - overlap  # Move the start forward by chunk_size minus the overlap
-        
-    # print(f"Text split into {len(chunks)} chunks with {chunk_size} characters per chunk and {overlap} character overlap.")
-    return chunks
-
-
-def load_chroma_collection(path, name):
-    # print(f"Loading Chroma collection from path: {path}, with collection name: {name}")
-    chroma_client = chromadb.PersistentClient(path=path)
-    
-    # Check if the collection exists, create it if not
-    try:
-        db = chroma_client.get_collection(name=name, embedding_function=GeminiEmbeddingFunction())
-        # print(f"Collection '{name}' loaded successfully.")
-    except ValueError:
-        # print(f"Collection '{name}' does not exist. Creating a new collection.")
-        db = chroma_client.create_collection(name=name, embedding_function=GeminiEmbeddingFunction())
-        # print(f"Collection '{name}' created successfully.")
-    
-    return db
-
-
-def store_embeddings_in_chroma(text_chunks, chroma_collection):
-    # print("Storing embeddings in Chroma...")
-    
-    # Generate unique IDs for each text chunk
-    ids = [f"doc_{i}" for i in range(len(text_chunks))]
-    
-    # Add the documents and their IDs to the Chroma collection
-    chroma_collection.add(documents=text_chunks, ids=ids)
-    
-    # print(f"Stored {len(text_chunks)} text chunks in Chroma.")
-
-def get_relevant_passage(query, db, n_results=3):
-    # print(f"Querying Chroma DB for: {query}")
-    results = db.query(query_texts=[query], n_results=n_results)['documents'][0]
-    # print(f"Relevant passage found: {results}")
-    return results
-
-def make_rag_prompt(query, relevant_passage):
-    # print(f"Creating RAG prompt for query: {query}")
-    escaped = relevant_passage.replace("'", "").replace('"', "").replace("\n", " ")
-    # prompt = ("""You are a helpful and informative bot that answers questions using text from the reference passage included below. \
-    #     Be sure to respond in a complete sentence, being comprehensive, including all relevant background information. \
-    #     However, you are talking to a non-technical audience, so be sure to break down complicated concepts and \
-    #     strike a friendly and conversational tone. \
-    #     If the passage is irrelevant to the answer, you may ignore it.
-    #     QUESTION: '{query}'
-    #     PASSAGE: '{relevant_passage}'
-
-    #     ANSWER:""").format(query=query, relevant_passage=escaped)
-    prompt = ("""Answer the question as detailed as possible from the provided context,
-        make sure to provide all the details, if the answer is not in
-        provided context just say, "answer is not available in the context",
-        don't provide the wrong answer\n\n
-        Context:\n {relevant_passage}\n
-        Question: \n{query}\n
-        Answer:""").format(query=query, relevant_passage=escaped)
-    # print("RAG prompt created.")
-    return prompt
-
-def generate_answer(prompt):
-    if not google_api_key:
-        raise ValueError("Google API Key not provided. Please provide it via db.get_google_api_key()")
-    
-    # print(f"Generating answer using Gemini model with prompt: {prompt[:100]}...")  # Only printing part of the prompt for readability
-    genai.configure(api_key=google_api_key)
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    
-    try:
-        answer = model.generate_content(prompt)
-        # print("Answer generated successfully.")
-    except Exception as e:
-        print(f"Error in generating answer: {e}")
-        raise e
-    
-    return answer.text
-
-def generate_answer_from_db(db, query):
-    # print(f"Generating answer for query: {query}")
-    relevant_text = get_relevant_passage(query, db, n_results=3)
-    prompt = make_rag_prompt(query, relevant_passage="".join(relevant_text))
-    answer = generate_answer(prompt)
-    return answer
-
-def gemini_chatbot(class_selected, subject_selected, chapter_selected, user_question, pdf_path=None):
-    # print(f"Starting chatbot for class: {class_selected}, subject: {subject_selected}, chapter: {chapter_selected}")
-    
-    if pdf_path:
-        # Load and process the PDF
-        pdf_text = load_pdf(pdf_path)
-        text_chunks = split_text(pdf_text, chunk_size=2000, overlap=200)
-        
-        chroma_collection = load_chroma_collection(path="Books/RAG/contents", name="rag_experiment")
-        # Store embeddings
-        store_embeddings_in_chroma(text_chunks, chroma_collection)
-    else:
-        print("No PDF path provided. Using existing Chroma collection.")
-        chroma_collection = load_chroma_collection(path="Books/RAG/contents", name="rag_experiment")
-
-    # print(f"Retrieving answer for question: {user_question}")
-    answer = generate_answer_from_db(chroma_collection, query=user_question)
-    # print(f"Answer retrieved: {answer}")
-    return answer
\ No newline at end of file
+import os
+import re
+import time
+from chromadb import Documents, EmbeddingFunction, Embeddings
+import google.generativeai as genai
+import db  # Import db for fetching the API key
+import answer_cache
+import bm25
+import chunker
+import collection_manager
+import context_packer
+import conversation
+import embedders
+import embedding_cache
+import gemini_client
+import ingest
+import metrics
+import resources
+import vector_store
+
+# Get Google API key from db.py
+google_api_key = db.get_google_api_key()
+
+# Location of the persisted Chroma index shared by the app and the ingestion command
+CHROMA_PATH = "Books/RAG/contents"
+COLLECTION_NAME = ingest.COLLECTION_NAME
+# "shared": every class and subject in COLLECTION_NAME. "per_subject": one collection and BM25
+# index per class and subject, named by collection_name() and opened through collection_manager.py
+COLLECTION_LAYOUT = os.getenv("EDURAG_COLLECTION_LAYOUT", "shared")
+
+# "chroma" (default) or "matrix" for the exact search store in vector_store.py
+VECTOR_STORE = os.getenv("EDURAG_VECTOR_STORE", "chroma")
+MATRIX_PATH = "Books/RAG/matrix"
+
+EMBEDDING_MODEL = "models/embedding-001"
+GENERATION_MODEL = "gemini-1.5-flash"
+# Gemini accepts at most 100 texts per batch embedding request
+EMBED_BATCH_SIZE = 100
+
+# Hybrid retrieval fuses this many vector and BM25 candidates per requested passage
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = 4
+
+# Chunks retrieved per question before context_packer trims them to CONTEXT_TOKEN_BUDGET
+CONTEXT_CANDIDATES = 8
+
+# Optional Gemini compatible REST endpoint, e.g. fake_gemini_server.py for load and failure tests
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+# Passages quoted in the degraded answer served while Gemini is unavailable
+DEGRADED_PASSAGES = 2
+
+# Answer for a chapter with nothing indexed; never cached, so it goes away once the chapter is ingested
+NO_MATERIAL_ANSWER = "No study material has been indexed for this chapter yet, so this question cannot be answered."
+
+_genai_configured = False
+
+def configure_genai():
+    # genai.configure only needs to run once per process
+    global _genai_configured
+    if not google_api_key and not GEMINI_API_ENDPOINT:
+        raise ValueError("Google API Key not provided. Please provide it via db.get_google_api_key()")
+    if not _genai_configured:
+        if GEMINI_API_ENDPOINT:
+            genai.configure(api_key=google_api_key or "local", transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+        else:
+            genai.configure(api_key=google_api_key)
+        _genai_configured = True
+
+class GeminiEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, model=EMBEDDING_MODEL, task_type="retrieval_document", batch_size=EMBED_BATCH_SIZE, cache=None):
+        self.model = model
+        self.task_type = task_type
+        self.batch_size = batch_size
+        self.cache = cache
+
+    def __call__(self, input: Documents) -> Embeddings:
+        cache = self.cache if self.cache is not None else embedding_cache.get_default_cache()
+        hashes = [embedding_cache.text_hash(text) for text in input]
+        embeddings = cache.get_many(self.model, self.task_type, hashes)
+        metrics.incr("embedding_cache_hits", len(embeddings))
+
+        # Only texts that are not cached yet go out, de-duplicated and in bounded batches
+        misses = {}
+        for key, text in zip(hashes, input):
+            if key not in embeddings:
+                misses.setdefault(key, text)
+
+        if misses:
+            metrics.incr("embedding_api_texts", len(misses))
+            configure_genai()
+            title = "Custom query" if self.task_type == "retrieval_document" else None
+            client = gemini_client.get_client(self.model)
+            keys = list(misses)
+            for start in range(0, len(keys), self.batch_size):
+                batch_keys = keys[start:start + self.batch_size]
+                try:
+                    with metrics.span("embed_api"):
+                        embedding_result = client.call(genai.embed_content, model=self.model, content=[misses[key] for key in batch_keys], task_type=self.task_type, title=title, request_options=gemini_client.REQUEST_OPTIONS)["embedding"]
+                except Exception as e:
+                    print(f"Error in generating embeddings: {e}")
+                    raise e
+                cache.put_many(self.model, self.task_type, zip(batch_keys, embedding_result))
+                embeddings.update(zip(batch_keys, embedding_result))
+
+        return [embeddings[key] for key in hashes]
+
+def load_pdf_pages(file_path):
+    # One string per page, so callers can keep track of page boundaries
+    with metrics.span("pdf_extract"):
+        return ingest.extract_pages(file_path)
+
+def load_pdf(file_path):
+    # print(f"Loading PDF from: {file_path}")
+    text = chunker.PAGE_SEPARATOR.join(load_pdf_pages(file_path))
+    # print("PDF loaded successfully and text extracted.")
+    return text
+
+def split_text(text, chunk_size=2000, overlap=200):
+    # Fixed-size character windows. Ingestion uses chunker.chunk_pages, which respects sentences,
+    # paragraphs and sections; this is kept for callers that only have plain text.
+    chunks = []
+    start = 0
+    
+    while start < len(text):
+        end = min(start + chunk_size, len(text))  # Ensure we don't go beyond the length of the text
+        chunks.append(text[start:end])
+        start += chunk_size - overlap  # Move the start forward by chunk_size minus the overlap
+        
+    # print(f"Text split into {len(chunks)} chunks with {chunk_size} characters per chunk and {overlap} character overlap.")
+    return chunks
+
+
+def make_embedding_function(spec):
+    # Build the embedding function described by a collection's embedder spec (see embedders.py)
+    if spec.startswith(embedders.LOCAL + ":"):
+        return embedders.local_from_spec(spec)
+    return GeminiEmbeddingFunction(model=spec.split(":", 1)[1])
+
+def collection_embedding_function(collection):
+    # Queries must be embedded with the backend the collection was indexed with
+    return make_embedding_function(embedders.collection_spec(collection))
+
+def open_chroma_collection(chroma_client, name):
+    # Check if the collection exists, create it if not
+    try:
+        db = chroma_client.get_collection(name=name, embedding_function=None)
+        # print(f"Collection '{name}' loaded successfully.")
+        spec = embedders.collection_spec(db)
+        embedders.check_compatible(name, spec)
+        db = chroma_client.get_collection(name=name, embedding_function=make_embedding_function(spec))
+    except ValueError as e:
+        if "does not exist" not in str(e):
+            raise
+        # print(f"Collection '{name}' does not exist. Creating a new collection.")
+        spec = embedders.default_spec(EMBEDDING_MODEL)
+        db = chroma_client.create_collection(name=name, metadata={"embedder": spec}, embedding_function=make_embedding_function(spec))
+        # print(f"Collection '{name}' created successfully.")
+    
+    return db
+
+
+def open_matrix_store(path, name):
+    # Same embedder bookkeeping as open_chroma_collection, for the exact search store
+    store = vector_store.MatrixStore(path, name)
+    if store.exists():
+        spec = embedders.collection_spec(store)
+        embedders.check_compatible(name, spec)
+    else:
+        spec = embedders.default_spec(EMBEDDING_MODEL)
+        store.create({"embedder": spec})
+    store.embedding_function = make_embedding_function(spec)
+    return store
+
+
+def load_chroma_collection(path, name):
+    # print(f"Loading Chroma collection from path: {path}, with collection name: {name}")
+    # The client and collection are opened once per process and reused across Streamlit reruns
+    if VECTOR_STORE == "matrix":
+        return resources.get_resource(("matrix_store", MATRIX_PATH, name), lambda: open_matrix_store(MATRIX_PATH, name))
+    return resources.get_chroma_collection(path, name, open_chroma_collection)
+
+
+def load_lexical_index(path, name):
+    # The BM25 index lives next to the Chroma files and is reloaded when ingestion rewrites it
+    index_path = os.path.join(path, f"{name}.bm25.json")
+    return resources.get_resource(("bm25_index", index_path), lambda: bm25.BM25Index.load(index_path), check=lambda index: index.reload_if_changed())
+
+
+def collection_name(class_selected, subject):
+    # e.g. rag_experiment_10_maths; Chroma names allow letters, digits, "_" and "-"
+    return f"{COLLECTION_NAME}_{class_selected}_{re.sub(r'[^a-z0-9]+', '_', str(subject).lower()).strip('_')}"
+
+
+def open_index(class_selected, subject):
+    name = collection_name(class_selected, subject)
+    return load_chroma_collection(path=CHROMA_PATH, name=name), load_lexical_index(path=CHROMA_PATH, name=name)
+
+
+def close_index(class_selected, subject):
+    # Forget the cached store and BM25 index so they can be garbage collected
+    name = collection_name(class_selected, subject)
+    resources.invalidate("chroma_collection", CHROMA_PATH, name)
+    resources.invalidate("matrix_store", MATRIX_PATH, name)
+    resources.invalidate("bm25_index", os.path.join(CHROMA_PATH, f"{name}.bm25.json"))
+
+
+def store_embeddings_in_chroma(text_chunks, chroma_collection, source, lexical_index=None):
+    # print("Storing embeddings in Chroma...")
+    # source identifies the document, e.g. ingest.source_key(path). Chunks the source no longer
+    # has are deleted, so two documents stored under one source would overwrite each other.
+    if not source:
+        raise ValueError("store_embeddings_in_chroma needs the source key of the document")
+    
+    # IDs come from the source and the chunk text, so storing a second document no longer
+    # overwrites the first and storing the same text again embeds nothing
+    ids = [ingest.chunk_id(source, text) for text in text_chunks]
+    
+    # Add the new chunks and drop the ones this source no longer has
+    stored = ingest.upsert_chunks(chroma_collection, source, ids, text_chunks, [{"source": source} for _ in text_chunks], lexical_index)
+    
+    # print(f"Stored {len(text_chunks)} text chunks in Chroma.")
+    return stored
+
+def scope_filter(class_selected=None, subject_selected=None, chapter_selected=None):
+    # Build a Chroma `where` filter from the class/subject/chapter picked on the Home page
+    conditions = []
+    if class_selected is not None:
+        conditions.append({"class": int(class_selected)})
+    if subject_selected is not None:
+        conditions.append({"subject": subject_selected})
+    if chapter_selected is not None:
+        conditions.append({"chapter": int(chapter_selected)})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+def embed_query(query, db=None):
+    with metrics.span("embed_query"):
+        embedding_function = collection_embedding_function(db) if db is not None else GeminiEmbeddingFunction()
+        return embedding_function([query])[0]
+
+def retrieve_candidates_batch(queries, db, n_results=3, where=None, query_embeddings=None, lexical_index=None):
+    # One ranked candidate list per query, from a single vector query for all of them.
+    # Each candidate is a {"id", "text", "metadata", "embedding"} dict.
+    # With a lexical index, over-fetch from both retrievers and merge them with reciprocal rank fusion
+    if not queries:
+        return []
+    hybrid = lexical_index is not None and len(lexical_index) > 0
+    n_candidates = n_results * HYBRID_CANDIDATES if hybrid else n_results
+    include = ["documents", "metadatas", "embeddings"]
+
+    if query_embeddings is not None:
+        # Reuse embeddings the caller already computed instead of embedding the queries again
+        vector_results = db.query(query_embeddings=list(query_embeddings), n_results=n_candidates, where=where, include=include)
+    else:
+        vector_results = db.query(query_texts=list(queries), n_results=n_candidates, where=where, include=include)
+
+    candidates = {}
+    rankings = []
+    for position in range(len(queries)):
+        for doc_id, text, metadata, embedding in zip(vector_results['ids'][position], vector_results['documents'][position], vector_results['metadatas'][position], vector_results['embeddings'][position]):
+            candidates[doc_id] = {"id": doc_id, "text": text, "metadata": metadata, "embedding": embedding}
+        rankings.append(vector_results['ids'][position])
+
+    if hybrid:
+        rankings = [
+            bm25.reciprocal_rank_fusion([ranked_ids, [doc_id for doc_id, _ in lexical_index.search(query, n_results=n_candidates, where=where)]])
+            for query, ranked_ids in zip(queries, rankings)
+        ]
+
+        # Chunks found only by BM25 still need their text, fetched once for all queries
+        missing = list(dict.fromkeys(doc_id for ranked_ids in rankings for doc_id in ranked_ids[:n_results] if doc_id not in candidates))
+        if missing:
+            fetched = db.get(ids=missing, include=include)
+            for doc_id, text, metadata, embedding in zip(fetched['ids'], fetched['documents'], fetched['metadatas'], fetched['embeddings']):
+                candidates[doc_id] = {"id": doc_id, "text": text, "metadata": metadata, "embedding": embedding}
+
+    return [[candidates[doc_id] for doc_id in ranked_ids[:n_results] if doc_id in candidates] for ranked_ids in rankings]
+
+def retrieve_candidates(query, db, n_results=3, where=None, query_embedding=None, lexical_index=None):
+    # Ranked list of {"id", "text", "metadata", "embedding"} dicts for the best n_results chunks
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return retrieve_candidates_batch([query], db, n_results=n_results, where=where, query_embeddings=query_embeddings, lexical_index=lexical_index)[0]
+
+def retrieve_lexical(query, db, n_results=3, where=None, lexical_index=None):
+    # BM25 only, for when the query cannot be embedded because Gemini is unavailable
+    if lexical_index is None or len(lexical_index) == 0:
+        return []
+    ids = [doc_id for doc_id, _ in lexical_index.search(query, n_results=n_results, where=where)]
+    if not ids:
+        return []
+    fetched = db.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+    found = {doc_id: {"id": doc_id, "text": text, "metadata": metadata, "embedding": embedding} for doc_id, text, metadata, embedding in zip(fetched['ids'], fetched['documents'], fetched['metadatas'], fetched['embeddings'])}
+    return [found[doc_id] for doc_id in ids if doc_id in found]
+
+def untagged(candidates):
+    # Chunks indexed before scope metadata existed. Chroma cannot filter on a missing key, so an
+    # unscoped search is narrowed to them afterwards; chunks of other subjects are never used.
+    return [candidate for candidate in candidates if (candidate["metadata"] or {}).get("subject") is None]
+
+def retrieve_context_batch(queries, db, query_embeddings, where=None, lexical_index=None):
+    # CONTEXT_CANDIDATES chunks per query for prompt packing
+    candidate_lists = retrieve_candidates_batch(queries, db, n_results=CONTEXT_CANDIDATES, where=where, query_embeddings=query_embeddings, lexical_index=lexical_index)
+    if where is not None:
+        empty = [position for position, candidates in enumerate(candidate_lists) if not candidates]
+        if empty:
+            print(f"No indexed chunks match {where}. Searching chunks without scope metadata.")
+            fallback = retrieve_candidates_batch([queries[position] for position in empty], db, n_results=CONTEXT_CANDIDATES, query_embeddings=[query_embeddings[position] for position in empty], lexical_index=lexical_index)
+            for position, candidates in zip(empty, fallback):
+                candidate_lists[position] = untagged(candidates)
+    return candidate_lists
+
+def get_relevant_passage(query, db, n_results=3, where=None, query_embedding=None, lexical_index=None):
+    # print(f"Querying Chroma DB for: {query}")
+    candidates = retrieve_candidates(query, db, n_results=n_results, where=where, query_embedding=query_embedding, lexical_index=lexical_index)
+    results = [candidate["text"] for candidate in candidates]
+    # print(f"Relevant passage found: {results}")
+    return results
+
+def make_rag_prompt(query, relevant_passage, history=""):
+    # print(f"Creating RAG prompt for query: {query}")
+    escaped = relevant_passage.replace("'", "").replace('"', "").replace("\n", " ")
+    # prompt = ("""You are a helpful and informative bot that answers questions using text from the reference passage included below. \
+    #     Be sure to respond in a complete sentence, being comprehensive, including all relevant background information. \
+    #     However, you are talking to a non-technical audience, so be sure to break down complicated concepts and \
+    #     strike a friendly and conversational tone. \
+    #     If the passage is irrelevant to the answer, you may ignore it.
+    #     QUESTION: '{query}'
+    #     PASSAGE: '{relevant_passage}'
+
+    #     ANSWER:""").format(query=query, relevant_passage=escaped)
+    prompt = ("""Answer the question as detailed as possible from the provided context,
+        make sure to provide all the details, if the answer is not in
+        provided context just say, "answer is not available in the context",
+        don't provide the wrong answer\n\n
+        {conversation}Context:\n {relevant_passage}\n
+        Question: \n{query}\n
+        Answer:""").format(query=query, relevant_passage=escaped, conversation=f"Conversation so far, only to understand the question:\n{history}\n\n" if history else "")
+    # print("RAG prompt created.")
+    return prompt
+
+def build_prompt(query, candidates, query_embedding=None, history=None):
+    # The RAG prompt, never over conversation.PROMPT_TOKEN_CEILING tokens: the question and the
+    # conversation come first and the passages get what is left, up to the packer's own budget.
+    # Returns (prompt, passage texts).
+    ceiling = conversation.PROMPT_TOKEN_CEILING
+    history_text = history.render() if history is not None else ""
+    fixed_tokens = chunker.count_tokens(make_rag_prompt(query, "", history_text))
+    # An overlong question gives up the conversation first, then its own tail
+    if fixed_tokens > ceiling // 2 and history_text:
+        history_text = ""
+        fixed_tokens = chunker.count_tokens(make_rag_prompt(query, ""))
+    if fixed_tokens > ceiling // 2:
+        query = chunker.truncate_tokens(query, chunker.count_tokens(query) - (fixed_tokens - ceiling // 2))
+        fixed_tokens = chunker.count_tokens(make_rag_prompt(query, ""))
+    relevant_text = context_packer.pack_context(candidates, query_embedding=query_embedding, token_budget=min(context_packer.TOKEN_BUDGET, ceiling - fixed_tokens))
+    return make_rag_prompt(query, "\n\n".join(relevant_text), history_text), relevant_text
+
+def generate_answer(prompt):
+    # print(f"Generating answer using Gemini model with prompt: {prompt[:100]}...")  # Only printing part of the prompt for readability
+    configure_genai()
+    model = resources.get_generative_model(GENERATION_MODEL)
+    
+    try:
+        with metrics.span("generate"):
+            answer = gemini_client.get_client(GENERATION_MODEL).call(model.generate_content, prompt, request_options=gemini_client.REQUEST_OPTIONS)
+        # print("Answer generated successfully.")
+    except Exception as e:
+        print(f"Error in generating answer: {e}")
+        raise e
+    
+    return answer.text
+
+def generate_answer_stream(prompt):
+    # Same as generate_answer, but yields the answer text piece by piece as Gemini produces it
+    configure_genai()
+    model = resources.get_generative_model(GENERATION_MODEL)
+
+    try:
+        with metrics.span("generate_stream"):
+            started = time.perf_counter()
+            first = True
+            # Retried like generate_answer until the first chunk arrives
+            for chunk in gemini_client.get_client(GENERATION_MODEL).stream(model.generate_content, prompt, stream=True, request_options=gemini_client.REQUEST_OPTIONS):
+                # The final chunk of a stream can carry only the finish reason and no text
+                if chunk.parts:
+                    if first:
+                        metrics.observe("time_to_first_token_seconds", time.perf_counter() - started)
+                        first = False
+                    yield chunk.text
+    except Exception as e:
+        print(f"Error in generating answer: {e}")
+        raise e
+
+def prepare_answer(db, query, where=None, scope=None, lexical_index=None, query_embedding=None, candidates=None, history=None):
+    # Shared front half of the blocking, streaming and batch paths.
+    # Returns (cached_answer, None, None, None) on a cache hit or when nothing is indexed for the
+    # scope (NO_MATERIAL_ANSWER), otherwise (None, prompt, save, fallback)
+    # where save(answer) stores the finished answer in the cache and fallback() builds the
+    # answer to show when Gemini cannot be reached.
+    # Batch callers pass the query_embedding and retrieved candidates they computed in bulk,
+    # the chat page passes the conversation.Conversation the question belongs to as history.
+    if query_embedding is None:
+        try:
+            query_embedding = embed_query(query, db)
+        except Exception as e:
+            if not gemini_client.is_unavailable(e):
+                raise
+            # Carry on with exact cache hits and BM25 retrieval only
+            print(f"Query embedding unavailable, using keyword retrieval: {e}")
+            metrics.incr("degraded_retrievals")
+
+    # Students of a class ask the same chapter questions in different words, so answers are
+    # cached per chapter and tied to the chapter's ingestion version
+    cache = answer_cache.get_default_cache()
+    version = ingest.scope_version(*scope) if scope is not None else None
+    if scope is not None:
+        with metrics.span("answer_cache"):
+            cached_answer = cache.get(scope, query, embedding=query_embedding, version=version)
+        if cached_answer is not None:
+            metrics.incr("answer_cache_hits")
+            return cached_answer, None, None, None
+        metrics.incr("answer_cache_misses")
+
+    if candidates is None:
+        with metrics.span("retrieve"):
+            if query_embedding is not None:
+                candidates = retrieve_context_batch([query], db, [query_embedding], where=where, lexical_index=lexical_index)[0]
+            else:
+                candidates = retrieve_lexical(query, db, n_results=CONTEXT_CANDIDATES, where=where, lexical_index=lexical_index)
+                if where is not None and not candidates:
+                    candidates = untagged(retrieve_lexical(query, db, n_results=CONTEXT_CANDIDATES, lexical_index=lexical_index))
+    if not candidates:
+        # Nothing for this chapter: say so instead of answering from another subject or from
+        # Gemini's own knowledge, and keep it out of the answer cache
+        metrics.incr("no_material_answers")
+        return NO_MATERIAL_ANSWER, None, None, None
+    # Merge overlapping chunks, drop duplicates and diversify, within the prompt token budget
+    with metrics.span("pack_context"):
+        prompt, relevant_text = build_prompt(query, candidates, query_embedding=query_embedding, history=history)
+    metrics.observe("retrieved_chunks", len(candidates))
+    metrics.observe("context_chunks", len(relevant_text))
+    if metrics.ENABLED:
+        metrics.observe("prompt_tokens", chunker.count_tokens(prompt))
+
+    def save(answer):
+        if scope is not None:
+            cache.put(scope, query, answer, embedding=query_embedding, version=version)
+
+    def fallback():
+        # An older or less similar cached answer for the chapter beats an error page;
+        # without one the student at least gets the textbook passages
+        metrics.incr("degraded_answers")
+        if scope is not None:
+            stale_answer = cache.get_fallback(scope, query, embedding=query_embedding)
+            if stale_answer is not None:
+                return stale_answer
+        if not relevant_text:
+            return "The answer service is busy right now. Please try again in a minute."
+        passages = "\n\n".join(relevant_text[:DEGRADED_PASSAGES])
+        return f"The answer service is busy right now, so here are the most relevant passages from your textbook:\n\n{passages}"
+
+    return None, prompt, save, fallback
+
+def generate_answer_from_db(db, query, where=None, scope=None, lexical_index=None, history=None):
+    # print(f"Generating answer for query: {query}")
+    cached_answer, prompt, save, fallback = prepare_answer(db, query, where=where, scope=scope, lexical_index=lexical_index, history=history)
+    if cached_answer is not None:
+        return cached_answer
+
+    try:
+        answer = generate_answer(prompt)
+    except Exception as e:
+        if not gemini_client.is_unavailable(e):
+            raise
+        # Degraded answers are not cached, the next question tries Gemini again
+        return fallback()
+    save(answer)
+    return answer
+
+def generate_answer_from_db_stream(db, query, where=None, scope=None, lexical_index=None, history=None):
+    cached_answer, prompt, save, fallback = prepare_answer(db, query, where=where, scope=scope, lexical_index=lexical_index, history=history)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    parts = []
+    try:
+        for text in generate_answer_stream(prompt):
+            parts.append(text)
+            yield text
+    except Exception as e:
+        # Once part of the answer is on screen there is nothing sensible to swap in
+        if parts or not gemini_client.is_unavailable(e):
+            raise
+        yield fallback()
+        return
+    # Only a completed stream is cached; an interrupted one would store a truncated answer
+    save("".join(parts))
+
+def prepare_chatbot(class_selected, subject_selected, chapter_selected, pdf_path=None):
+    # print(f"Starting chatbot for class: {class_selected}, subject: {subject_selected}, chapter: {chapter_selected}")
+    
+    if COLLECTION_LAYOUT == "per_subject":
+        chroma_collection, lexical_index = collection_manager.get_index(class_selected, subject_selected)
+    else:
+        chroma_collection = load_chroma_collection(path=CHROMA_PATH, name=COLLECTION_NAME)
+        lexical_index = load_lexical_index(path=CHROMA_PATH, name=COLLECTION_NAME)
+
+    if pdf_path:
+        # Index the PDF through the ingestion manifest so an unchanged file is not re-embedded.
+        # Whole books should be loaded offline with `python ingest.py` instead.
+        with metrics.span("ingest_pdf"):
+            ingested = ingest.ingest_pdf(pdf_path, chroma_collection, class_selected=class_selected, subject=subject_selected, chapter=chapter_selected, lexical_index=lexical_index)
+        if ingested:
+            answer_cache.get_default_cache().invalidate((class_selected, subject_selected, chapter_selected))
+    else:
+        print("No PDF path provided. Using existing Chroma collection.")
+
+    # Only search the chapter the student picked instead of every book in the collection
+    where = scope_filter(class_selected, subject_selected, chapter_selected)
+    scope = (class_selected, subject_selected, chapter_selected)
+    return chroma_collection, where, scope, lexical_index if HYBRID_SEARCH else None
+
+def resolve_query(db, user_question, scope, history):
+    # The question to retrieve, cache and remember. Short questions are rewritten as follow-ups,
+    # but one that is already answered in the cache as asked is served from there without the
+    # extra Gemini call. Questions with "it", "this" etc. always depend on the conversation.
+    if history is None or not history.needs_rewrite(user_question):
+        return user_question
+    if scope is not None and not conversation.refers_back(user_question):
+        try:
+            query_embedding = embed_query(user_question, db)
+        except Exception as e:
+            if not gemini_client.is_unavailable(e):
+                raise
+            query_embedding = None
+        version = ingest.scope_version(*scope)
+        if answer_cache.get_default_cache().peek(scope, user_question, embedding=query_embedding, version=version):
+            return user_question
+    return history.standalone_query(user_question)
+
+def gemini_chatbot(class_selected, subject_selected, chapter_selected, user_question, pdf_path=None, history=None):
+    # history: the conversation.Conversation of the session, or None to answer the question alone
+    metrics.incr("questions")
+    with metrics.span("prepare_chatbot"):
+        chroma_collection, where, scope, lexical_index = prepare_chatbot(class_selected, subject_selected, chapter_selected, pdf_path)
+
+    query = resolve_query(chroma_collection, user_question, scope, history)
+    # print(f"Retrieving answer for question: {user_question}")
+    answer = generate_answer_from_db(chroma_collection, query=query, where=where, scope=scope, lexical_index=lexical_index, history=history)
+    # print(f"Answer retrieved: {answer}")
+    if history is not None:
+        history.add_turn(query, answer)
+    return answer
+
+def gemini_chatbot_stream(class_selected, subject_selected, chapter_selected, user_question, pdf_path=None, history=None):
+    # Generator variant of gemini_chatbot: yields the answer in pieces so the page can render
+    # the first tokens while Gemini is still generating the rest
+    metrics.incr("questions")
+    with metrics.span("prepare_chatbot"):
+        chroma_collection, where, scope, lexical_index = prepare_chatbot(class_selected, subject_selected, chapter_selected, pdf_path)
+    # Follow-ups are retrieved, cached and remembered as the standalone question
+    query = resolve_query(chroma_collection, user_question, scope, history)
+    parts = []
+    for text in generate_answer_from_db_stream(chroma_collection, query=query, where=where, scope=scope, lexical_index=lexical_index, history=history):
+        parts.append(text)
+        yield text
+    if history is not None:
+        history.add_turn(query, "".join(parts))
@@ -0,0 +1,304 @@
+import os
+import random
+import threading
+import time
+
+import requests
+
+import metrics
+import resources
+
+# Shared protection for every Gemini call, one GeminiClient per model:
+#   token bucket      caps the request rate so a classroom burst is spread out instead of
+#                     turning into a wall of 429s
+#   adaptive limiter  caps requests in flight; halves the cap when Gemini throttles or fails
+#                     with a retryable error and raises it by one per window of successful
+#                     calls (AIMD); other errors leave it as it is
+#   retry             retryable errors (429, 5xx, timeouts, dropped connections) are retried
+#                     with full jitter exponential backoff
+#   circuit breaker   after repeated failures calls fail fast with CircuitOpenError for a
+#                     cool-down period, so callers can serve a cached or degraded answer
+
+GENERATE_RATE = float(os.getenv("GEMINI_GENERATE_RPS", "2"))
+EMBED_RATE = float(os.getenv("GEMINI_EMBED_RPS", "10"))
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8.0
+# Longest a call waits for a rate or concurrency slot before giving up
+ACQUIRE_TIMEOUT = float(os.getenv("GEMINI_ACQUIRE_TIMEOUT", "30"))
+BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Dropped connections and timeouts; the REST transport raises the requests versions, which do not
+# subclass the builtin ConnectionError and TimeoutError
+RETRYABLE_ERRORS = (
+    ConnectionError, TimeoutError,
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError,
+)
+
+# Pass as request_options to genai calls: retries happen here, not again inside google-api-core
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+REQUEST_OPTIONS = {"retry": None, "timeout": REQUEST_TIMEOUT_SECONDS}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def status_of(error):
+    # google.api_core exceptions carry the HTTP status as an int `code`
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return status_of(error) in RETRYABLE_STATUS
+
+
+def is_throttled(error):
+    return status_of(error) == 429
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"No request slot within {timeout:.0f}s")
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    def __init__(self, limit=2, minimum=1, maximum=MAX_CONCURRENCY):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                raise RateLimitTimeout(f"No concurrency slot within {timeout:.0f}s")
+            self.in_flight += 1
+
+    def release(self, succeeded=False, overloaded=False):
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif succeeded:
+                # +1 per `limit` successful calls, i.e. roughly one step per window
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        # After the cool-down one probe call is let through; its outcome closes or re-opens the breaker.
+        # Returns True for the probe call.
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+        raise CircuitOpenError("Gemini is failing, not sending requests for now")
+
+    @property
+    def probing(self):
+        return self._probing
+
+    def cancel_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class GeminiClient:
+    def __init__(self, model, rate, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+        self.model = model
+        self.bucket = TokenBucket(rate)
+        self.limiter = AdaptiveLimiter()
+        self.breaker = CircuitBreaker()
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _sleep_before_retry(self, attempt, error):
+        delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff * (2 ** attempt)))
+        print(f"Gemini {self.model} call failed ({error}), retrying in {delay:.1f}s")
+        metrics.incr("gemini_retries", model=self.model)
+        time.sleep(delay)
+
+    def _enter(self):
+        # Returns True when this call is the breaker's half-open probe
+        probe = self.breaker.allow()
+        try:
+            self.bucket.acquire()
+            self.limiter.acquire()
+        except RateLimitTimeout:
+            if probe:
+                self.breaker.cancel_probe()
+            raise
+        return probe
+
+    def _failed(self, error, attempt):
+        # Returns True when the call should be retried
+        if is_throttled(error):
+            metrics.incr("gemini_throttled", model=self.model)
+        if not is_retryable(error):
+            # Gemini answered (e.g. 400 for a bad request), so it is not a reason to open the breaker
+            self.breaker.record_success()
+            return False
+        # A failed probe re-opens the breaker straight away instead of retrying
+        if attempt == self.max_retries or self.breaker.probing:
+            self.breaker.record_failure()
+            return False
+        return True
+
+    def call(self, fn, *args, **kwargs):
+        # fn(*args, **kwargs) with rate limiting, retries and circuit breaking
+        for attempt in range(self.max_retries + 1):
+            probe = self._enter()
+            error = None
+            succeeded = False
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+                if not self._failed(e, attempt):
+                    raise
+            except BaseException:
+                # Interrupted without an outcome; hand the probe back so the next call can probe
+                if probe:
+                    self.breaker.cancel_probe()
+                raise
+            else:
+                succeeded = True
+                self.breaker.record_success()
+                return result
+            finally:
+                self.limiter.release(succeeded, overloaded=error is not None and is_retryable(error))
+            self._sleep_before_retry(attempt, error)
+
+    def stream(self, fn, *args, **kwargs):
+        # Like call() for a function returning an iterator. A failure before the first item is
+        # retried; once items were handed out a retry would repeat them, so it is raised.
+        for attempt in range(self.max_retries + 1):
+            probe = self._enter()
+            error = None
+            started = False
+            succeeded = False
+            try:
+                for item in fn(*args, **kwargs):
+                    started = True
+                    yield item
+            except Exception as e:
+                error = e
+                if started:
+                    # Not retried, so a probe is settled here: re-opened by an outage, handed back otherwise
+                    if is_retryable(e):
+                        self.breaker.record_failure()
+                    elif probe:
+                        self.breaker.cancel_probe()
+                    raise
+                if not self._failed(e, attempt):
+                    raise
+            except BaseException:
+                # The caller closed the stream (GeneratorExit on a Streamlit rerun or when the student
+                # navigates away). Chunks that already arrived show Gemini is up; without any, the
+                # probe is handed back. Either way the breaker must not stay half-open for good.
+                if started:
+                    succeeded = True
+                    self.breaker.record_success()
+                elif probe:
+                    self.breaker.cancel_probe()
+                raise
+            else:
+                succeeded = True
+                self.breaker.record_success()
+                return
+            finally:
+                self.limiter.release(succeeded, overloaded=error is not None and is_retryable(error))
+            self._sleep_before_retry(attempt, error)
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "breaker": self.breaker.state,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "tokens": round(self.bucket.tokens, 2),
+        }
+
+
+def is_unavailable(error):
+    # Errors after which callers should degrade instead of failing the page
+    return isinstance(error, (CircuitOpenError, RateLimitTimeout)) or is_retryable(error)
+
+
+def get_client(model, rate=None):
+    # One client per model for the whole process, shared by every session
+    if rate is None:
+        rate = EMBED_RATE if "embedding" in model else GENERATE_RATE
+    return resources.get_resource(("gemini_client", model), lambda: GeminiClient(model, rate))
+
+
+def stats():
+    return [get_client(key[1]).stats() for key in resources.stats()["resources"] if key[0] == "gemini_client"]
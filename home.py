@@ -1,69 +1,106 @@
-import streamlit as st
-from firebase_admin import firestore
-from gemini_chatbot import gemini_chatbot
-
-
-
-def app():
-    if 'db' not in st.session_state:
-        st.session_state.db = firestore.client()
-    
-    db = st.session_state.db
-
-    # Check if user is logged in
-    if st.session_state.username == '':
-        st.warning("Please login to access chat functionality.")
-        return
-
-    # User selects Class, Subject, and Chapter
-    st.header("Select Class, Subject, and Chapter")
-
-    class_selected = st.selectbox("Select Class", [10, 9, 8])
-    subject_selected = st.selectbox("Select Subject", ['Maths', 'English', 'Hindi'])
-    chapter_selected = st.selectbox("Select Chapter", [1, 2, 3])
-
-    # Textbox for user input to chat with the bot
-    chat_input = st.text_area(label=f"Ask a question about Class {class_selected}, {subject_selected}, Chapter {chapter_selected}", placeholder="Type your question here...")
-
-    if st.button("Submit Query"):
-        if chat_input:
-            # Call to the chatbot (dummy function for now)
-            response = gemini_chatbot(class_selected, subject_selected, chapter_selected, chat_input)
-            st.success(f"Chatbot Response: {response}")
-
-            # Store the conversation (question + response) as JSON in Firestore
-            info = db.collection('Chats').document(st.session_state.username).get()
-            chat_json = {f"{chat_input}": response}
-            
-            if info.exists:
-                info = info.to_dict()
-                if 'Content' in info.keys():
-                    pos = db.collection('Chats').document(st.session_state.username)
-                    # Update Firestore with the new question-answer pair
-                    pos.update({u'Content': firestore.ArrayUnion([chat_json])})
-                else:
-                    data = {"Content": [chat_json], 'Username': st.session_state.username}
-                    db.collection('Chats').document(st.session_state.username).set(data)
-            else:
-                data = {"Content": [chat_json], 'Username': st.session_state.username}
-                db.collection('Chats').document(st.session_state.username).set(data)
-            
-            st.success('Conversation saved!')
-
-    st.header('Previous Chats')
-
-    # Query to get chats for the logged-in user only
-    user_chat = db.collection('Chats').document(st.session_state.username).get()
-    if user_chat.exists:
-        user_chat_data = user_chat.to_dict()
-        try:
-            # Display each question and answer stored in JSON format for this user
-            for chat in user_chat_data['Content'][::-1]:
-                for question, answer in chat.items():
-                    st.markdown(f"**Question:** {question}")
-                    st.markdown(f"**Answer:** {answer}")
-                    st.markdown("---")  # To separate each conversation visually
-        except:
-            st.warning("No chats found for this user.")
-    else:
-        st.warning("No previous chats available.")
+import streamlit as st
+from firebase_admin import firestore
+from gemini_chatbot import gemini_chatbot_stream
+import chat_store
+import conversation
+import firebase_setup
+import metrics
+
+
+def app():
+    firebase_setup.ensure_firebase()
+    if 'db' not in st.session_state:
+        st.session_state.db = firestore.client()
+    
+    db = st.session_state.db
+
+    # Check if user is logged in
+    if st.session_state.username == '':
+        st.warning("Please login to access chat functionality.")
+        return
+
+    # User selects Class, Subject, and Chapter
+    st.header("Select Class, Subject, and Chapter")
+
+    class_selected = st.selectbox("Select Class", [10, 9, 8])
+    subject_selected = st.selectbox("Select Subject", ['Maths', 'English', 'Hindi'])
+    chapter_selected = st.selectbox("Select Chapter", [1, 2, 3])
+
+    # Follow-up questions are answered in the context of the conversation about this chapter
+    scope = (class_selected, subject_selected, chapter_selected)
+    history = conversation.get_conversation(st.session_state, st.session_state.username, scope)
+    if len(history):
+        st.button("Start a new conversation", on_click=conversation.reset, args=(st.session_state, st.session_state.username, scope))
+
+    # Textbox for user input to chat with the bot
+    chat_input = st.text_area(label=f"Ask a question about Class {class_selected}, {subject_selected}, Chapter {chapter_selected}", placeholder="Type your question here...")
+
+    # Start reading Previous Chats now so the Firestore round trip overlaps with answering
+    history_future = chat_store.prefetch_history(st.session_state, db, st.session_state.username)
+    writer = chat_store.get_writer(db)
+    exchange = None
+
+    if st.button("Submit Query"):
+        if chat_input:
+            # Stream the answer into the page as it is generated
+            response_placeholder = st.empty()
+            response = ""
+            with metrics.span("answer_total"):
+                for text in gemini_chatbot_stream(class_selected, subject_selected, chapter_selected, chat_input, history=history):
+                    response += text
+                    response_placeholder.markdown(f"Chatbot Response: {response}")
+            response_placeholder.success(f"Chatbot Response: {response}")
+
+            # Store the conversation (question + response) as its own document in Firestore.
+            # The write happens in the background and never delays showing the answer.
+            with metrics.span("firestore_write_chat"):
+                exchange = chat_store.new_exchange(db, st.session_state.username, chat_input, response, class_selected, subject_selected, chapter_selected)
+                writer.submit(st.session_state.username, exchange)
+
+    # Report saves only once the writer has an outcome, without waiting for it: exchanges still
+    # being written are checked again on the next run, so a write that fails after retrying is
+    # not missed either
+    saving = st.session_state.setdefault('saving_exchanges', [])
+    if exchange is not None:
+        saving.append(exchange['id'])
+    saved = failed = 0
+    for exchange_id in list(saving):
+        status = writer.status(exchange_id)
+        if status == 'saving':
+            continue
+        saving.remove(exchange_id)
+        if status == 'failed':
+            failed += 1
+            chat_store.forget_exchange(st.session_state, exchange_id)
+            if exchange is not None and exchange['id'] == exchange_id:
+                exchange = None
+        elif status == 'saved':
+            saved += 1
+    if saving:
+        st.info('Saving conversation...')
+    elif saved:
+        st.success('Conversation saved!')
+    if failed:
+        st.error(f"{failed} conversation{'s' if failed > 1 else ''} could not be saved to your chat history. Please try again later.")
+
+    st.header('Previous Chats')
+
+    # Only the newest page is read; older chats are fetched page by page on request
+    with metrics.span("firestore_read_history"):
+        chats = chat_store.history_window(st.session_state, db, st.session_state.username, prefetched=history_future)
+    if exchange is not None:
+        # The new exchange comes from local state, not from reading it back
+        chat_store.remember_exchange(st.session_state, st.session_state.username, exchange)
+        chats = st.session_state['chat_history']
+    if chats:
+        # Display each question and answer stored for this user, newest first
+        for chat in chats:
+            st.markdown(f"**Question:** {chat['question']}")
+            st.markdown(f"**Answer:** {chat['answer']}")
+            st.markdown("---")  # To separate each conversation visually
+        if chat_store.has_older(st.session_state):
+            st.button("Load older chats", on_click=chat_store.load_older, args=(st.session_state, db, st.session_state.username))
+        elif len(chats) >= chat_store.MAX_RENDERED:
+            st.caption(f"Showing your {chat_store.MAX_RENDERED} most recent chats.")
+    else:
+        st.warning("No previous chats available.")
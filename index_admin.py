@@ -0,0 +1,305 @@
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import sys
+from collections import Counter
+
+import embedders
+import ingest
+
+# Maintenance commands for the vector index, the BM25 index and the ingestion manifest:
+#   python index_admin.py stats                      # sizes and chunk counts per source and chapter
+#   python index_admin.py check                      # integrity checks, exits 1 on problems
+#   python index_admin.py orphans [--delete]         # chunks and manifest entries without a PDF
+#   python index_admin.py vacuum                     # compact SQLite files, drop unused segment files
+#   python index_admin.py drop --source Book/x.pdf   # remove one PDF's chunks
+#   python index_admin.py drop --all --yes           # remove the whole collection
+#   python index_admin.py --class 10 --subject Maths check   # one collection of the per_subject layout
+# Works on the store the app uses, i.e. EDURAG_VECTOR_STORE / EDURAG_COLLECTION apply here too.
+# With EDURAG_COLLECTION_LAYOUT=per_subject and no --subject, every per-subject collection in the
+# manifest is processed in turn. Each collection only sees the manifest entries recorded for it.
+
+CHUNK_ID = re.compile(r"^(?P<source>.+)#(?P<digest>[0-9a-f]{16})$")
+REQUIRED_METADATA = ("source", "class", "subject", "chapter", "page")
+
+
+def open_index(name=ingest.COLLECTION_NAME):
+    from gemini_chatbot import CHROMA_PATH, MATRIX_PATH, VECTOR_STORE, load_chroma_collection, load_lexical_index
+
+    index_path = MATRIX_PATH if VECTOR_STORE == "matrix" else CHROMA_PATH
+    return {
+        "store": VECTOR_STORE,
+        "name": name,
+        "path": index_path,
+        "chroma_path": CHROMA_PATH,
+        "collection": load_chroma_collection(path=CHROMA_PATH, name=name),
+        "lexical_index": load_lexical_index(path=CHROMA_PATH, name=name),
+        "manifest": ingest.load_manifest(),
+    }
+
+
+def manifest_files(index):
+    # Manifest entries of the PDFs indexed into this collection; entries written before the
+    # collection was recorded belong to the shared one
+    return {
+        source: entry for source, entry in index["manifest"]["files"].items()
+        if entry.get("collection", ingest.COLLECTION_NAME) == index["name"]
+    }
+
+
+def collection_names(class_selected=None, subject=None):
+    # The collections a command runs on
+    from gemini_chatbot import COLLECTION_LAYOUT, collection_name
+
+    if subject is not None:
+        return [collection_name(class_selected if class_selected is not None else ingest.DEFAULT_CLASS, subject)]
+    if COLLECTION_LAYOUT != "per_subject":
+        return [ingest.COLLECTION_NAME]
+    recorded = {entry.get("collection", ingest.COLLECTION_NAME) for entry in ingest.load_manifest()["files"].values()}
+    return sorted(
+        name for name in recorded
+        if name.startswith(f"{ingest.COLLECTION_NAME}_") and (class_selected is None or name.startswith(f"{ingest.COLLECTION_NAME}_{class_selected}_"))
+    )
+
+
+def all_chunks(collection, include=("documents", "metadatas")):
+    found = collection.get(include=list(include))
+    rows = []
+    for position, doc_id in enumerate(found["ids"]):
+        rows.append({
+            "id": doc_id,
+            "text": found["documents"][position] if "documents" in include else None,
+            "metadata": (found["metadatas"][position] or {}) if "metadatas" in include else {},
+            "embedding": found["embeddings"][position] if "embeddings" in include else None,
+        })
+    return rows
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def stats(index):
+    chunks = all_chunks(index["collection"], include=("metadatas",))
+    per_source = Counter(chunk["metadata"].get("source", "<none>") for chunk in chunks)
+    per_scope = Counter(
+        f"class {chunk['metadata'].get('class')} / {chunk['metadata'].get('subject')} / chapter {chunk['metadata'].get('chapter')}"
+        for chunk in chunks
+    )
+    return {
+        "store": index["store"],
+        "collection": index["name"],
+        "embedder": embedders.collection_spec(index["collection"]),
+        "chunks": len(chunks),
+        "bm25_documents": len(index["lexical_index"]),
+        "manifest_files": len(manifest_files(index)),
+        "index_bytes": directory_size(index["path"]),
+        "chunks_per_source": dict(sorted(per_source.items())),
+        "chunks_per_scope": dict(sorted(per_scope.items())),
+    }
+
+
+def find_orphans(index):
+    # Chunks whose PDF is no longer indexed (or that predate source tagging), manifest entries
+    # whose PDF was deleted, and BM25 documents the vector index no longer has
+    manifest_sources = set(manifest_files(index))
+    chunks = all_chunks(index["collection"], include=("metadatas",))
+    chunk_ids = {chunk["id"] for chunk in chunks}
+    return {
+        "chunks": sorted(chunk["id"] for chunk in chunks if chunk["metadata"].get("source") not in manifest_sources),
+        "manifest": sorted(source for source in manifest_sources if not os.path.exists(source)),
+        "bm25": sorted(doc_id for doc_id in index["lexical_index"].docs if doc_id not in chunk_ids),
+    }
+
+
+def delete_orphans(index, orphans):
+    if orphans["chunks"]:
+        index["collection"].delete(ids=orphans["chunks"])
+    for source in orphans["manifest"]:
+        ingest.delete_source(index["collection"], source, index["lexical_index"])
+        del index["manifest"]["files"][source]
+    index["lexical_index"].delete(ids=orphans["chunks"] + orphans["bm25"])
+    index["lexical_index"].save()
+    ingest.save_manifest(index["manifest"])
+
+
+def check(index):
+    # Returns a list of problems; an empty list means the index is consistent
+    problems = []
+    chunks = all_chunks(index["collection"], include=("documents", "metadatas", "embeddings"))
+
+    legacy = 0
+    seen = {}
+    dimensions = Counter()
+    for chunk in chunks:
+        metadata = chunk["metadata"]
+        match = CHUNK_ID.match(chunk["id"])
+        if not match:
+            legacy += 1
+        elif match.group("source") != metadata.get("source") or ingest.chunk_id(metadata.get("source"), chunk["text"]) != chunk["id"]:
+            problems.append(f"{chunk['id']}: id does not match its source and text")
+        missing = [key for key in REQUIRED_METADATA if metadata.get(key) is None]
+        if missing and match:
+            problems.append(f"{chunk['id']}: missing metadata {', '.join(missing)}")
+        key = (metadata.get("source"), chunk["text"])
+        if key in seen:
+            problems.append(f"{chunk['id']}: duplicate of {seen[key]}")
+        seen.setdefault(key, chunk["id"])
+
+        embedding = chunk["embedding"]
+        dimensions[len(embedding)] += 1
+        norm = math.sqrt(sum(value * value for value in embedding))
+        if not math.isfinite(norm) or norm == 0:
+            problems.append(f"{chunk['id']}: embedding is zero or not finite")
+
+    if legacy:
+        problems.append(f"{legacy} chunks use ids from before content hashing; run `python ingest.py --force` (cached embeddings are reused) or `index_admin.py orphans --delete`")
+    if len(dimensions) > 1:
+        problems.append(f"Mixed embedding dimensions: {dict(dimensions)}")
+
+    per_source = Counter(chunk["metadata"].get("source") for chunk in chunks)
+    for source, entry in manifest_files(index).items():
+        if per_source.get(source, 0) != entry.get("chunks"):
+            problems.append(f"{source}: manifest records {entry.get('chunks')} chunks, index has {per_source.get(source, 0)}")
+
+    chunk_ids = {chunk["id"] for chunk in chunks}
+    bm25_ids = set(index["lexical_index"].docs)
+    if bm25_ids and bm25_ids != chunk_ids:
+        problems.append(f"BM25 index is out of step: {len(chunk_ids - bm25_ids)} chunks missing, {len(bm25_ids - chunk_ids)} extra")
+
+    if index["store"] != "matrix":
+        connection = sqlite3.connect(os.path.join(index["chroma_path"], "chroma.sqlite3"))
+        try:
+            result = connection.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            connection.close()
+        if result != "ok":
+            problems.append(f"chroma.sqlite3 integrity check: {result}")
+    return problems
+
+
+def vacuum(index):
+    # Reclaims space left by deleted chunks. Returns bytes before and after.
+    before = directory_size(index["path"])
+    if index["store"] == "matrix":
+        store = index["collection"]
+        referenced = set()
+        for path in store._segment_paths().values():
+            with open(path, "r", encoding="utf-8") as f:
+                referenced.add(json.load(f)["vectors"])
+        for file_name in os.listdir(store.path):
+            if file_name.endswith(".tmp") or (file_name.endswith(".npy") and file_name not in referenced):
+                try:
+                    os.remove(os.path.join(store.path, file_name))
+                except OSError as e:
+                    # Still mapped by a running app on Windows; removed by a later vacuum
+                    print(f"Could not remove {file_name}: {e}")
+    else:
+        sqlite_path = os.path.join(index["chroma_path"], "chroma.sqlite3")
+        connection = sqlite3.connect(sqlite_path)
+        try:
+            # HNSW directories of collections that were dropped are never cleaned up by Chroma
+            segments = {row[0] for row in connection.execute("SELECT id FROM segments")}
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+        for entry in os.listdir(index["chroma_path"]):
+            path = os.path.join(index["chroma_path"], entry)
+            if os.path.isdir(path) and re.fullmatch(r"[0-9a-f-]{36}", entry) and entry not in segments:
+                shutil.rmtree(path)
+    index["lexical_index"].save()
+    return before, directory_size(index["path"])
+
+
+def drop(index, source=None):
+    if source is not None:
+        ingest.delete_source(index["collection"], source, index["lexical_index"])
+        index["lexical_index"].save()
+        if source in manifest_files(index):
+            del index["manifest"]["files"][source]
+            ingest.save_manifest(index["manifest"])
+        return
+
+    import resources
+
+    if index["store"] == "matrix":
+        shutil.rmtree(index["collection"].path, ignore_errors=True)
+    else:
+        resources.get_chroma_client(index["chroma_path"]).delete_collection(name=index["name"])
+    resources.invalidate("chroma_collection")
+    resources.invalidate("matrix_store")
+    index["lexical_index"].delete(ids=list(index["lexical_index"].docs))
+    index["lexical_index"].save()
+    # Nothing is indexed in this collection any more, so the next ingest run has to start from scratch
+    for source in manifest_files(index):
+        del index["manifest"]["files"][source]
+    ingest.save_manifest(index["manifest"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain the textbook index.")
+    parser.add_argument("--class", dest="class_selected", type=int, default=None, help="Class of the per-subject collection to work on")
+    parser.add_argument("--subject", default=None, help="Subject of the per-subject collection to work on, e.g. Maths")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Chunk counts and index size")
+    commands.add_parser("check", help="Verify ids, metadata, embeddings, manifest and BM25 agree")
+    orphans_parser = commands.add_parser("orphans", help="List chunks and manifest entries whose PDF is gone")
+    orphans_parser.add_argument("--delete", action="store_true", help="Remove the orphans that were found")
+    commands.add_parser("vacuum", help="Compact the index files")
+    drop_parser = commands.add_parser("drop", help="Delete one source or the whole collection")
+    drop_parser.add_argument("--source", help="Source path as recorded in the manifest, e.g. Book/Maths/chapter_1_real_numbers.pdf")
+    drop_parser.add_argument("--all", action="store_true", help="Drop the whole collection")
+    drop_parser.add_argument("--yes", action="store_true", help="Confirm --all")
+    args = parser.parse_args()
+
+    names = collection_names(args.class_selected, args.subject)
+    if not names:
+        parser.error("no per-subject collections recorded in the manifest; pass --subject")
+    if args.command == "drop" and len(names) > 1:
+        parser.error("drop works on one collection; pass --subject (and --class)")
+
+    problems = []
+    for name in names:
+        index = open_index(name)
+        if len(names) > 1:
+            print(f"== {name}")
+        if args.command == "stats":
+            print(json.dumps(stats(index), indent=2))
+        elif args.command == "check":
+            found = check(index)
+            for problem in found:
+                print(problem)
+            problems.extend(found)
+        elif args.command == "orphans":
+            orphans = find_orphans(index)
+            print(json.dumps(orphans, indent=2))
+            if args.delete:
+                delete_orphans(index, orphans)
+                print(f"Removed {len(orphans['chunks'])} chunks, {len(orphans['manifest'])} manifest entries, {len(orphans['bm25'])} BM25 documents")
+        elif args.command == "vacuum":
+            before, after = vacuum(index)
+            print(f"Index size {before} -> {after} bytes")
+        elif args.command == "drop":
+            if args.source:
+                drop(index, source=args.source)
+                print(f"Dropped {args.source}")
+            elif args.all and args.yes:
+                drop(index)
+                print(f"Dropped collection '{index['name']}'")
+            else:
+                parser.error("drop needs --source SOURCE, or --all --yes")
+    if args.command == "check":
+        print(f"{len(problems)} problems found")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+import chunker
+import embedders
+
+# Textbooks are laid out as Book/<Subject>/chapter_<N>_<title>.pdf
+BOOK_ROOT = "Book"
+MANIFEST_PATH = "Books/RAG/manifest.json"
+CHAPTER_PATTERN = re.compile(r"^chapter_(\d+)_.*\.pdf$")
+
+# Collection of the "shared" layout, which holds every class and subject. Manifest entries
+# written before the collection was recorded all belong to it.
+COLLECTION_NAME = os.getenv("EDURAG_COLLECTION", "rag_experiment")
+
+# The Book/ tree has no class level yet, every subject is indexed for this class unless --class is given
+DEFAULT_CLASS = 10
+
+# Number of chunks handed to Chroma (and therefore to the embedding function) per add() call
+ADD_BATCH_SIZE = 64
+
+
+def discover_pdfs(book_root=BOOK_ROOT):
+    # Walk Book/<Subject>/ and collect every chapter PDF with its subject and chapter number
+    pdfs = []
+    if not os.path.isdir(book_root):
+        return pdfs
+
+    for subject in sorted(os.listdir(book_root)):
+        subject_dir = os.path.join(book_root, subject)
+        if not os.path.isdir(subject_dir):
+            continue
+        for file_name in sorted(os.listdir(subject_dir)):
+            if CHAPTER_PATTERN.match(file_name):
+                pdfs.append(describe_pdf(os.path.join(subject_dir, file_name)))
+    return pdfs
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_key(path):
+    # Manifest entries and chunk metadata use a stable, platform independent relative path
+    return os.path.relpath(path).replace(os.sep, "/")
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    # Write to a temporary file first so a crash never leaves a half written manifest behind
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+_manifest_memo = {"path": None, "mtime": None, "manifest": None}
+
+
+def cached_manifest(path=MANIFEST_PATH):
+    # Cheap read-only view of the manifest for the query path; only re-read when the file changes
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {"files": {}}
+    if _manifest_memo["path"] != path or _manifest_memo["mtime"] != mtime:
+        _manifest_memo.update(path=path, mtime=mtime, manifest=load_manifest(path))
+    return _manifest_memo["manifest"]
+
+
+def scope_version(class_selected, subject, chapter, manifest_path=MANIFEST_PATH):
+    # Fingerprint of everything indexed for one chapter; changes whenever the chapter is re-ingested
+    entries = [
+        f"{source}:{entry['sha256']}:{entry['ingested_at']}"
+        for source, entry in sorted(cached_manifest(manifest_path)["files"].items())
+        if (entry.get("class"), entry.get("subject"), entry.get("chapter")) == (class_selected, subject, chapter)
+    ]
+    return hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()[:16]
+
+
+def extract_pages(path):
+    # Runs inside a worker process, so it only returns plain picklable data
+    reader = PdfReader(path)
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def delete_source(chroma_collection, source, lexical_index=None):
+    chroma_collection.delete(where={"source": source})
+    if lexical_index is not None:
+        lexical_index.delete(where={"source": source})
+
+
+def chunk_id(source, text):
+    # The same text from the same file always gets the same id, so re-indexing an edited file
+    # only embeds the chunks that actually changed
+    return f"{source}#{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+
+def upsert_chunks(chroma_collection, source, ids, text_chunks, metadatas, lexical_index=None):
+    # Make the chunks stored for source exactly ids: add the new ones, update the metadata of
+    # chunks that only moved, delete the ones that are gone. Returns counts per action.
+    # Identical passages within one file (repeated boxes, running headers) are stored once.
+    chunks = {}
+    for doc_id, text, metadata in zip(ids, text_chunks, metadatas):
+        chunks.setdefault(doc_id, (text, metadata))
+
+    found = chroma_collection.get(where={"source": source}, include=["metadatas"])
+    existing = dict(zip(found["ids"], found["metadatas"]))
+    stale = [doc_id for doc_id in existing if doc_id not in chunks]
+    new = [doc_id for doc_id in chunks if doc_id not in existing]
+    moved = [doc_id for doc_id in chunks if doc_id in existing and existing[doc_id] != chunks[doc_id][1]]
+
+    if stale:
+        chroma_collection.delete(ids=stale)
+    for start in range(0, len(new), ADD_BATCH_SIZE):
+        batch = new[start:start + ADD_BATCH_SIZE]
+        chroma_collection.add(documents=[chunks[doc_id][0] for doc_id in batch], ids=batch, metadatas=[chunks[doc_id][1] for doc_id in batch])
+    for start in range(0, len(moved), ADD_BATCH_SIZE):
+        batch = moved[start:start + ADD_BATCH_SIZE]
+        chroma_collection.update(ids=batch, metadatas=[chunks[doc_id][1] for doc_id in batch])
+
+    # Keep the BM25 index used for hybrid retrieval in step with the collection. Tokenising is
+    # cheap, so the source is simply rebuilt there.
+    if lexical_index is not None:
+        lexical_index.delete(where={"source": source})
+        lexical_index.add(list(chunks), [text for text, _ in chunks.values()], [metadata for _, metadata in chunks.values()])
+        lexical_index.save()
+
+    return {"chunks": len(chunks), "added": len(new), "updated": len(moved), "removed": len(stale)}
+
+
+def describe_pdf(path):
+    # Subject and chapter come from the Book/<Subject>/chapter_<N>_*.pdf layout
+    match = CHAPTER_PATTERN.match(os.path.basename(path))
+    return {
+        "path": path,
+        "subject": os.path.basename(os.path.dirname(path)),
+        "chapter": int(match.group(1)) if match else 0,
+    }
+
+
+def index_pages(pages, source, chroma_collection, class_selected, subject, chapter, lexical_index=None):
+    chunks = chunker.chunk_pages(pages)
+    text_chunks = [chunk["text"] for chunk in chunks]
+    ids = [chunk_id(source, text) for text in text_chunks]
+    # Every chunk is tagged with its scope so queries can be restricted to one chapter,
+    # and with its position so answers can point back to pages and sections
+    metadatas = [
+        {
+            "source": source, "chunk": i, "class": class_selected, "subject": subject, "chapter": chapter,
+            "page": chunk["page_start"], "page_end": chunk["page_end"], "section": chunk["section"],
+            "char_start": chunk["char_start"], "char_end": chunk["char_end"],
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+
+    # Only chunks whose text is new are embedded; whatever an older version of this file
+    # left behind is removed
+    return upsert_chunks(chroma_collection, source, ids, text_chunks, metadatas, lexical_index)
+
+
+def record_ingested(manifest, source, sha256, pages, chunks, class_selected, subject, chapter, embedder=embedders.LEGACY_SPEC, collection=COLLECTION_NAME):
+    manifest["files"][source] = {
+        "sha256": sha256,
+        "collection": collection,
+        "class": class_selected,
+        "subject": subject,
+        "chapter": chapter,
+        "chunker": chunker.CHUNKER_VERSION,
+        "embedder": embedder,
+        "pages": pages,
+        "chunks": chunks,
+        "ingested_at": time.time(),
+    }
+
+
+def needs_ingest(entry, sha256, class_selected, subject, chapter, embedder=embedders.LEGACY_SPEC, collection=COLLECTION_NAME):
+    # Re-index when the file changed, was indexed under a different scope, with an older chunker,
+    # into a collection with a different embedder or into another collection altogether
+    if not entry:
+        return True
+    indexed = (entry["sha256"], entry.get("class"), entry.get("subject"), entry.get("chapter"), entry.get("chunker"), entry.get("embedder", embedders.LEGACY_SPEC), entry.get("collection", COLLECTION_NAME))
+    return indexed != (sha256, class_selected, subject, chapter, chunker.CHUNKER_VERSION, embedder, collection)
+
+
+def ingest_pdf(pdf_path, chroma_collection, class_selected=DEFAULT_CLASS, subject=None, chapter=None, lexical_index=None, manifest_path=MANIFEST_PATH, force=False):
+    # Single file entry point used by gemini_chatbot(pdf_path=...); skips the file if it is unchanged
+    pdf = describe_pdf(pdf_path)
+    subject = subject if subject is not None else pdf["subject"]
+    chapter = chapter if chapter is not None else pdf["chapter"]
+
+    manifest = load_manifest(manifest_path)
+    source = source_key(pdf_path)
+    sha256 = file_sha256(pdf_path)
+
+    embedder = embedders.collection_spec(chroma_collection)
+    if not force and not needs_ingest(manifest["files"].get(source), sha256, class_selected, subject, chapter, embedder, chroma_collection.name):
+        return False
+
+    pages = extract_pages(pdf_path)
+    indexed = index_pages(pages, source, chroma_collection, class_selected, subject, chapter, lexical_index)
+    record_ingested(manifest, source, sha256, len(pages), indexed["chunks"], class_selected, subject, chapter, embedder, chroma_collection.name)
+    save_manifest(manifest, manifest_path)
+    return True
+
+
+def ingest_book_tree(chroma_collection, book_root=BOOK_ROOT, class_selected=DEFAULT_CLASS, lexical_index=None, manifest_path=MANIFEST_PATH, workers=None, force=False, subjects=None):
+    # subjects: only index these subjects of class_selected into chroma_collection (one
+    # collection per class and subject); None indexes the whole tree
+    manifest = load_manifest(manifest_path)
+    pdfs = [pdf for pdf in discover_pdfs(book_root) if subjects is None or pdf["subject"] in subjects]
+    embedder = embedders.collection_spec(chroma_collection)
+    collection = chroma_collection.name
+
+    # Only new or edited PDFs need to be extracted, chunked and embedded again
+    pending = []
+    for pdf in pdfs:
+        source = source_key(pdf["path"])
+        sha256 = file_sha256(pdf["path"])
+        if force or needs_ingest(manifest["files"].get(source), sha256, class_selected, pdf["subject"], pdf["chapter"], embedder, collection):
+            pending.append((pdf, source, sha256))
+
+    # Drop chunks of PDFs that were removed from the book tree. Only sources under book_root and
+    # in the scope being indexed count; PDFs uploaded through the Home page live elsewhere and are
+    # left to `index_admin.py orphans`.
+    present = {source_key(pdf["path"]) for pdf in pdfs}
+    root = source_key(book_root).rstrip("/") + "/"
+    removed = [
+        source for source, entry in manifest["files"].items()
+        if source not in present and source.startswith(root) and entry.get("class") == class_selected
+        and (subjects is None or entry.get("subject") in subjects)
+    ]
+    for source in removed:
+        delete_source(chroma_collection, source, lexical_index)
+        del manifest["files"][source]
+    if removed:
+        if lexical_index is not None:
+            lexical_index.save()
+        save_manifest(manifest, manifest_path)
+
+    stats = {"discovered": len(pdfs), "skipped": len(pdfs) - len(pending), "ingested": 0, "removed": len(removed), "pages": 0, "chunks": 0, "embedded": 0}
+    if not pending:
+        return stats
+
+    # Page extraction is CPU bound, so it is fanned out over a process pool while this
+    # process embeds and stores each PDF as soon as its pages are available
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        page_results = pool.map(extract_pages, [pdf["path"] for pdf, _, _ in pending])
+        for (pdf, source, sha256), pages in zip(pending, page_results):
+            indexed = index_pages(pages, source, chroma_collection, class_selected, pdf["subject"], pdf["chapter"], lexical_index)
+            # Save after every PDF so an interrupted run resumes where it stopped
+            record_ingested(manifest, source, sha256, len(pages), indexed["chunks"], class_selected, pdf["subject"], pdf["chapter"], embedder, collection)
+            save_manifest(manifest, manifest_path)
+
+            stats["ingested"] += 1
+            stats["pages"] += len(pages)
+            stats["chunks"] += indexed["chunks"]
+            stats["embedded"] += indexed["added"]
+            print(f"Indexed {source}: {len(pages)} pages, {indexed['chunks']} chunks ({indexed['added']} new, {indexed['updated']} moved, {indexed['removed']} removed)")
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the textbooks under Book/ into the Chroma collection.")
+    parser.add_argument("--book-root", default=BOOK_ROOT)
+    parser.add_argument("--class", dest="class_selected", type=int, default=DEFAULT_CLASS, help="Class the books under --book-root belong to")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="Processes used for PDF page extraction")
+    parser.add_argument("--force", action="store_true", help="Re-index every PDF even if it is unchanged")
+    args = parser.parse_args()
+
+    from gemini_chatbot import CHROMA_PATH, COLLECTION_LAYOUT, collection_name, load_chroma_collection, load_lexical_index
+
+    if COLLECTION_LAYOUT == "per_subject":
+        # Subjects whose folder was removed are visited too, so their chunks are dropped
+        recorded = [entry["subject"] for entry in load_manifest(args.manifest)["files"].values() if entry.get("class") == args.class_selected]
+        subjects = sorted({pdf["subject"] for pdf in discover_pdfs(args.book_root)} | set(recorded))
+        targets = [([subject], collection_name(args.class_selected, subject)) for subject in subjects]
+    else:
+        targets = [(None, COLLECTION_NAME)]
+
+    for subjects, name in targets:
+        chroma_collection = load_chroma_collection(path=CHROMA_PATH, name=name)
+        lexical_index = load_lexical_index(path=CHROMA_PATH, name=name)
+        started = time.time()
+        stats = ingest_book_tree(chroma_collection, book_root=args.book_root, class_selected=args.class_selected, lexical_index=lexical_index, manifest_path=args.manifest, workers=args.workers, force=args.force, subjects=subjects)
+        print(f"{name} done in {time.time() - started:.1f}s: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Lightweight per-stage timings and counters for the question answering path.
+# Disabled unless EDURAG_METRICS=1; when disabled span() hands back a shared no-op context
+# manager and observe()/incr() return immediately, so instrumented code pays one flag check.
+ENABLED = os.getenv("EDURAG_METRICS", "0") == "1"
+
+# Number of most recent observations kept per histogram for the rolling quantiles
+WINDOW = int(os.getenv("EDURAG_METRICS_WINDOW", "1024"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+class RollingHistogram:
+    def __init__(self, window=WINDOW):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        ordered = sorted(self.values)
+        summary = {"count": self.count, "sum": self.total, "max": ordered[-1] if ordered else 0.0}
+        for q in QUANTILES:
+            summary[f"p{int(q * 100)}"] = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+        return summary
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        observe("stage_seconds", time.perf_counter() - self.started, stage=self.stage)
+        if exc_type is not None:
+            incr("stage_errors", stage=self.stage)
+        return False
+
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = enabled
+
+
+def span(stage):
+    # with metrics.span("retrieve"): ...  records the duration under stage_seconds{stage="retrieve"}
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+def observe(name, value, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = RollingHistogram()
+        histogram.add(value)
+
+
+def incr(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def snapshot():
+    with _lock:
+        histograms = [{"name": name, "labels": dict(labels), **histogram.summary()} for (name, labels), histogram in sorted(_histograms.items())]
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(_counters.items())]
+    return {"enabled": ENABLED, "window": WINDOW, "histograms": histograms, "counters": counters}
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def _label_text(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def to_prometheus(prefix="edurag"):
+    # Prometheus text exposition format: histograms as summaries, counters as *_total
+    data = snapshot()
+    lines = []
+    typed = set()
+    for histogram in data["histograms"]:
+        name = f"{prefix}_{histogram['name']}"
+        if name not in typed:
+            lines.append(f"# TYPE {name} summary")
+            typed.add(name)
+        for q in QUANTILES:
+            lines.append(f"{name}{_label_text(histogram['labels'], quantile=q)} {histogram[f'p{int(q * 100)}']}")
+        lines.append(f"{name}_sum{_label_text(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{name}_count{_label_text(histogram['labels'])} {histogram['count']}")
+    for counter in data["counters"]:
+        name = f"{prefix}_{counter['name']}_total"
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_label_text(counter['labels'])} {counter['value']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+import chromadb
+import google.generativeai as genai
+from chromadb.config import Settings
+
+# Process wide registry of expensive clients. Streamlit re-runs the page script on every
+# widget interaction, but imported modules survive, so objects stored here are built once
+# per process and shared by every session.
+
+# Cached objects are re-validated at most this often
+HEALTH_CHECK_INTERVAL = 30.0
+
+# Memory budget for open indexes (see collection_manager.py). Chroma gets it as the limit of its
+# LRU cache of loaded vector segments, measured in segment file size; 0 keeps every segment loaded.
+CHROMA_MEMORY_LIMIT_BYTES = int(float(os.getenv("EDURAG_INDEX_MEMORY_MB", "0")) * 1024 * 1024)
+
+# _lock only guards the dicts; building or checking a resource holds the lock of its key, so a
+# slow Chroma open does not hold up lookups of the Gemini model or Firestore client
+_lock = threading.Lock()
+_resources = {}
+_key_locks = {}
+
+
+class _Entry:
+    def __init__(self, value, check):
+        self.value = value
+        self.check = check
+        self.checked_at = time.monotonic()
+
+
+def _healthy(entry):
+    if entry.check is None or time.monotonic() - entry.checked_at < HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        entry.check(entry.value)
+    except Exception as e:
+        print(f"Discarding unhealthy resource: {e}")
+        return False
+    entry.checked_at = time.monotonic()
+    return True
+
+
+def get_resource(key, create, check=None):
+    # Return the cached object for key, (re)building it with create() when missing or unhealthy.
+    # check(value) should raise if the object can no longer be used.
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.RLock())
+    with key_lock:
+        with _lock:
+            entry = _resources.get(key)
+        if entry is not None and _healthy(entry):
+            return entry.value
+        entry = _Entry(create(), check)
+        with _lock:
+            _resources[key] = entry
+        return entry.value
+
+
+def invalidate(*prefix):
+    # Drop every cached object whose key starts with prefix, e.g. invalidate("chroma_collection", path)
+    with _lock:
+        for key in [key for key in _resources if key[:len(prefix)] == prefix]:
+            del _resources[key]
+
+
+def get_chroma_client(path):
+    def create():
+        # Collections opened from a previous client must not outlive it
+        invalidate("chroma_collection", path)
+        if CHROMA_MEMORY_LIMIT_BYTES:
+            settings = Settings(chroma_segment_cache_policy="LRU", chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_BYTES)
+            return chromadb.PersistentClient(path=path, settings=settings)
+        return chromadb.PersistentClient(path=path)
+
+    return get_resource(("chroma_client", path), create, check=lambda client: client.heartbeat())
+
+
+def get_chroma_collection(path, name, open_collection):
+    # open_collection(client, name) gets or creates the collection with the right embedding function
+    def create():
+        client = get_chroma_client(path)
+        return open_collection(client, name)
+
+    return get_resource(("chroma_collection", path, name), create, check=lambda collection: collection.count())
+
+
+def get_generative_model(model_name):
+    return get_resource(("gemini_model", model_name), lambda: genai.GenerativeModel(model_name))
+
+
+def stats():
+    with _lock:
+        return {"resources": [list(key) for key in _resources]}
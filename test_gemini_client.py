@@ -0,0 +1,109 @@
+import time
+
+import requests
+
+import gemini_client
+
+
+def make_client():
+    client = gemini_client.GeminiClient("test-model", rate=1000, max_retries=0)
+    client.breaker = gemini_client.CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    return client
+
+
+def open_breaker(client):
+    client.breaker.record_failure()
+    time.sleep(0.02)
+    assert client.breaker.state == "half_open"
+
+
+def chunks():
+    yield "first"
+    yield "second"
+
+
+def test_probe_stream_closed_early_releases_probe():
+    client = make_client()
+    open_breaker(client)
+
+    stream = client.stream(chunks)
+    assert next(stream) == "first"
+    assert client.breaker.probing
+    # What a Streamlit rerun does to an answer that is still streaming
+    stream.close()
+
+    assert not client.breaker.probing
+    assert client.breaker.state == "closed"
+    assert client.call(lambda: "ok") == "ok"
+
+
+def test_interrupted_probe_call_is_handed_back():
+    client = make_client()
+    open_breaker(client)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    try:
+        client.call(interrupted)
+    except KeyboardInterrupt:
+        pass
+
+    assert not client.breaker.probing
+    assert client.breaker.state == "half_open"
+    assert client.call(lambda: "ok") == "ok"
+    assert client.breaker.state == "closed"
+
+
+class BadRequest(Exception):
+    code = 400
+
+
+def test_probe_stream_failing_after_output_settles_probe():
+    client = make_client()
+    open_breaker(client)
+
+    def broken():
+        yield "first"
+        raise BadRequest("invalid argument")
+
+    stream = client.stream(broken)
+    assert next(stream) == "first"
+    try:
+        next(stream)
+    except BadRequest:
+        pass
+
+    assert not client.breaker.probing
+    assert client.call(lambda: "ok") == "ok"
+    assert client.breaker.state == "closed"
+
+
+def test_requests_transport_errors_are_retryable():
+    for error in (requests.exceptions.ConnectionError("reset"), requests.exceptions.ReadTimeout("slow"), requests.exceptions.ChunkedEncodingError("cut")):
+        assert gemini_client.is_retryable(error)
+        assert gemini_client.is_unavailable(error)
+    assert not gemini_client.is_retryable(requests.exceptions.InvalidURL("bad"))
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+def test_limit_only_grows_on_success():
+    client = gemini_client.GeminiClient("test-model", rate=1000, max_retries=0)
+    client.breaker = gemini_client.CircuitBreaker(failure_threshold=100)
+    limit = client.limiter.limit
+
+    def unavailable():
+        raise Unavailable("overloaded")
+
+    for _ in range(5):
+        try:
+            client.call(unavailable)
+        except Unavailable:
+            pass
+    assert client.limiter.limit == client.limiter.minimum < limit
+
+    client.call(lambda: "ok")
+    assert client.limiter.limit > client.limiter.minimum
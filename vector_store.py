@@ -0,0 +1,370 @@
+import argparse
+import json
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+
+import bm25
+
+# Exact search vector store for the small per-chapter corpora of the textbooks.
+# Every (class, subject, chapter) is a segment: an L2 normalised float16 or int8 matrix saved as
+# .npy and memory mapped on first use, plus a JSON file with the ids, documents and metadata.
+# Queries score all rows of the matching segments with one matrix product, so results are
+# exact and there is no HNSW graph or SQLite lookup per query.
+#
+# The JSON file is the commit point of a segment: a rebuild writes a new uniquely named .npy,
+# then atomically replaces the JSON that references it, so readers in other processes see
+# either the old or the new segment, never a mix. SCOPES_FILE maps every segment key to its scope,
+# so a scoped query opens only the segments of that scope.
+#
+# The class mirrors the parts of the Chroma collection API the app uses (add, delete, get,
+# query, count, metadata), so it can stand in for the collection in gemini_chatbot and ingest.
+
+DTYPE = os.getenv("EDURAG_VECTOR_DTYPE", "float16")
+SCOPE_FIELDS = ("class", "subject", "chapter")
+STORE_FILE = "store.json"
+SCOPES_FILE = "scopes.json"
+
+
+def segment_key(metadata):
+    scope = [f"{field}-{metadata.get(field)}" for field in SCOPE_FIELDS if metadata.get(field) is not None]
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", "_".join(scope)) or "unscoped"
+
+
+def where_fields(where):
+    fields = set()
+    for key, value in (where or {}).items():
+        if key in ("$and", "$or"):
+            for condition in value:
+                fields |= where_fields(condition)
+        else:
+            fields.add(key)
+    return fields
+
+
+def normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantise(vectors, dtype):
+    # Returns (matrix, scales); int8 keeps one float scale per row
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    raise ValueError(f"Unsupported EDURAG_VECTOR_DTYPE {dtype!r}, expected 'float16' or 'int8'")
+
+
+class Segment:
+    def __init__(self, path, data):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.ids = data["ids"]
+        self.documents = data["documents"]
+        self.metadatas = data["metadatas"]
+        self.scope = data["scope"]
+        self.vectors_file = data["vectors"]
+        self.scales = np.asarray(data["scales"], dtype=np.float32) if data.get("scales") is not None else None
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        # Only mapped, not read: pages are faulted in by the first query that touches them
+        self.matrix = np.load(os.path.join(os.path.dirname(path), self.vectors_file), mmap_mode="r")
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    def vectors(self, rows=None):
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        vectors = np.asarray(matrix, dtype=np.float32)
+        if self.scales is not None:
+            vectors = vectors * (self.scales if rows is None else self.scales[rows])[:, None]
+        return vectors
+
+
+class MatrixStore:
+    def __init__(self, path, name, embedding_function=None, dtype=DTYPE):
+        self.path = os.path.join(path, name)
+        self.name = name
+        self.embedding_function = embedding_function
+        self.dtype = dtype
+        self.metadata = None
+        self._segments = {}
+        self._scopes = {}
+        self._scopes_mtime = None
+        self._lock = threading.RLock()
+        store_path = os.path.join(self.path, STORE_FILE)
+        if os.path.exists(store_path):
+            with open(store_path, "r", encoding="utf-8") as f:
+                self.metadata = json.load(f).get("metadata")
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, STORE_FILE))
+
+    def create(self, metadata=None):
+        os.makedirs(self.path, exist_ok=True)
+        self._write_json(os.path.join(self.path, STORE_FILE), {"name": self.name, "metadata": metadata})
+        self.metadata = metadata
+
+    # Segments
+
+    def _segment_paths(self):
+        if not os.path.isdir(self.path):
+            return {}
+        return {
+            file_name[:-len(".json")]: os.path.join(self.path, file_name)
+            for file_name in os.listdir(self.path)
+            if file_name.endswith(".json") and file_name not in (STORE_FILE, SCOPES_FILE)
+        }
+
+    def _segment(self, key, path):
+        # Load on demand, and again whenever a rebuild swapped the file
+        with self._lock:
+            segment = self._segments.get(key)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._segments.pop(key, None)
+                return None
+            if segment is None or segment.mtime != mtime:
+                segment = self._segments[key] = Segment.load(path)
+            return segment
+
+    def _scope_index(self):
+        # {segment key: scope}, re-read whenever another process rewrote it
+        path = os.path.join(self.path, SCOPES_FILE)
+        with self._lock:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                return {}
+            if mtime != self._scopes_mtime:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._scopes = json.load(f)
+                self._scopes_mtime = mtime
+            return self._scopes
+
+    def _update_scope_index(self, changes):
+        # changes maps segment keys to their scope, or to None for removed segments
+        with self._lock:
+            scopes = dict(self._scope_index())
+            for key, scope in changes.items():
+                if scope is None:
+                    scopes.pop(key, None)
+                else:
+                    scopes[key] = scope
+            self._write_json(os.path.join(self.path, SCOPES_FILE), scopes)
+
+    def _matching_segments(self, where):
+        # With a filter on scope fields only, whole segments are selected without looking at rows,
+        # and segments the scope index rules out are never loaded
+        scope_only = where_fields(where) <= set(SCOPE_FIELDS)
+        scopes = self._scope_index() if scope_only else {}
+        segments = []
+        unindexed = {}
+        for key, path in sorted(self._segment_paths().items()):
+            if key in scopes and not bm25.matches_where(scopes[key], where):
+                continue
+            segment = self._segment(key, path)
+            if segment is None:
+                continue
+            if scope_only and key not in scopes:
+                # Written before the store kept a scope index
+                unindexed[key] = segment.scope
+            if scope_only and not bm25.matches_where(segment.scope, where):
+                continue
+            segments.append(segment)
+        if unindexed:
+            self._update_scope_index(unindexed)
+        return segments, scope_only
+
+    def _rows(self, segment, where, scope_only):
+        if not where or scope_only:
+            return list(range(len(segment.ids)))
+        return [row for row, metadata in enumerate(segment.metadatas) if bm25.matches_where(metadata, where)]
+
+    def _write_json(self, path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _write_segment(self, key, ids, documents, metadatas, vectors):
+        path = os.path.join(self.path, f"{key}.json")
+        scope = None
+        if not ids:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            matrix, scales = quantise(normalise(vectors), self.dtype)
+            vectors_file = f"{key}.{uuid.uuid4().hex[:12]}.npy"
+            np.save(os.path.join(self.path, vectors_file), matrix)
+            scope = {field: metadatas[0].get(field) for field in SCOPE_FIELDS}
+            self._write_json(path, {
+                "scope": scope,
+                "ids": ids,
+                "documents": documents,
+                "metadatas": metadatas,
+                "vectors": vectors_file,
+                "scales": scales.tolist() if scales is not None else None,
+            })
+        self._update_scope_index({key: scope})
+        # The old .npy is left in place: processes that still map it keep reading it until they
+        # reload, and Windows cannot delete a mapped file. `index_admin.py vacuum` removes it.
+        with self._lock:
+            self._segments.pop(key, None)
+
+    # Chroma collection API
+
+    def count(self):
+        return sum(len(segment.ids) for segment in self._matching_segments(None)[0])
+
+    def add(self, ids, documents, metadatas=None, embeddings=None):
+        metadatas = metadatas or [{} for _ in ids]
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        groups = {}
+        for doc_id, document, metadata, embedding in zip(ids, documents, metadatas, embeddings):
+            groups.setdefault(segment_key(metadata), []).append((doc_id, document, metadata, embedding))
+
+        with self._lock:
+            for key, rows in groups.items():
+                path = os.path.join(self.path, f"{key}.json")
+                segment = self._segment(key, path) if os.path.exists(path) else None
+                new_ids = {row[0] for row in rows}
+                kept = [row for row, doc_id in enumerate(segment.ids) if doc_id not in new_ids] if segment else []
+                self._write_segment(
+                    key,
+                    [segment.ids[row] for row in kept] + [row[0] for row in rows],
+                    [segment.documents[row] for row in kept] + [row[1] for row in rows],
+                    [segment.metadatas[row] for row in kept] + [row[2] for row in rows],
+                    np.vstack([segment.vectors(kept) if kept else np.zeros((0, len(rows[0][3])), dtype=np.float32),
+                               np.asarray([row[3] for row in rows], dtype=np.float32)]),
+                )
+
+    def update(self, ids, metadatas):
+        # Metadata only, the stored vectors are kept. A changed scope moves rows to another segment.
+        with self._lock:
+            current = self.get(ids=ids, include=["documents", "embeddings"])
+            changed = dict(zip(ids, metadatas))
+            self.delete(ids=current["ids"])
+            self.add(ids=current["ids"], documents=current["documents"], metadatas=[changed[doc_id] for doc_id in current["ids"]], embeddings=current["embeddings"])
+
+    def delete(self, ids=None, where=None):
+        if ids is not None:
+            ids = set(ids)
+            if not ids:
+                return
+        with self._lock:
+            for segment in self._matching_segments(where if ids is None else None)[0]:
+                matched = [row for row in range(len(segment.ids))
+                           if (segment.ids[row] in ids if ids is not None else bm25.matches_where(segment.metadatas[row], where))]
+                if not matched:
+                    continue
+                kept = sorted(set(range(len(segment.ids))) - set(matched))
+                self._write_segment(
+                    segment_key(segment.scope),
+                    [segment.ids[row] for row in kept],
+                    [segment.documents[row] for row in kept],
+                    [segment.metadatas[row] for row in kept],
+                    segment.vectors(kept) if kept else None,
+                )
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        result = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        wanted = set(ids) if ids is not None else None
+        segments, scope_only = self._matching_segments(where)
+        found = {}
+        for segment in segments:
+            if wanted is not None:
+                rows = [segment.rows[doc_id] for doc_id in wanted if doc_id in segment.rows]
+                rows = [row for row in rows if not where or scope_only or bm25.matches_where(segment.metadatas[row], where)]
+            else:
+                rows = self._rows(segment, where, scope_only)
+            for row in rows:
+                found[segment.ids[row]] = (segment, row)
+        # Chroma returns ids in the requested order when ids are given
+        order = [doc_id for doc_id in ids if doc_id in found] if ids is not None else list(found)
+        for doc_id in order:
+            segment, row = found[doc_id]
+            result["ids"].append(doc_id)
+            result["documents"].append(segment.documents[row])
+            result["metadatas"].append(segment.metadatas[row])
+            if "embeddings" in include:
+                result["embeddings"].append(segment.vectors([row])[0].tolist())
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None, include=("documents", "metadatas", "distances")):
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        queries = normalise(query_embeddings)
+        segments, scope_only = self._matching_segments(where)
+
+        # Score every query against every candidate row in one product
+        candidates = []
+        blocks = []
+        for segment in segments:
+            rows = self._rows(segment, where, scope_only)
+            if rows:
+                candidates.extend((segment, row) for row in rows)
+                blocks.append(segment.vectors(None if len(rows) == len(segment.ids) else rows))
+        result = {key: [] for key in ("ids", "documents", "metadatas", "embeddings", "distances")}
+        scores = queries @ np.vstack(blocks).T if blocks else np.zeros((len(queries), 0), dtype=np.float32)
+
+        k = min(n_results, scores.shape[1])
+        for query_scores in scores:
+            top = np.argpartition(-query_scores, k - 1)[:k] if 0 < k < len(query_scores) else np.arange(k)
+            top = top[np.argsort(-query_scores[top], kind="stable")]
+            picked = [candidates[index] for index in top]
+            result["ids"].append([segment.ids[row] for segment, row in picked])
+            result["documents"].append([segment.documents[row] for segment, row in picked])
+            result["metadatas"].append([segment.metadatas[row] for segment, row in picked])
+            result["embeddings"].append([segment.vectors([row])[0].tolist() for segment, row in picked])
+            # Cosine distance, comparable to Chroma's "cosine" space
+            result["distances"].append([float(1.0 - query_scores[index]) for index in top])
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+
+def copy_from_chroma(collection, store, batch_size=500):
+    # Rebuild the store from a Chroma collection without embedding anything again.
+    # Each segment is swapped in atomically; segments with no rows left are removed.
+    groups = {}
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+        for row in zip(batch["ids"], batch["documents"], batch["metadatas"], batch["embeddings"]):
+            groups.setdefault(segment_key(row[2] or {}), []).append(row)
+
+    if not store.exists():
+        store.create(collection.metadata)
+    with store._lock:
+        for key, rows in groups.items():
+            store._write_segment(key, [row[0] for row in rows], [row[1] for row in rows], [row[2] or {} for row in rows], np.asarray([row[3] for row in rows], dtype=np.float32))
+        for key in set(store._segment_paths()) - set(groups):
+            store._write_segment(key, [], [], [], None)
+    return sum(len(rows) for rows in groups.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the exact search vector store from the Chroma collection.")
+    parser.add_argument("--dtype", default=DTYPE, choices=["float16", "int8"])
+    args = parser.parse_args()
+
+    import resources
+    from gemini_chatbot import CHROMA_PATH, COLLECTION_NAME, MATRIX_PATH, open_chroma_collection
+
+    collection = resources.get_chroma_collection(CHROMA_PATH, COLLECTION_NAME, open_chroma_collection)
+    store = MatrixStore(MATRIX_PATH, COLLECTION_NAME, dtype=args.dtype)
+    copied = copy_from_chroma(collection, store)
+    print(f"Copied {copied} chunks into {store.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,42 @@
-import streamlit as st
-from firebase_admin import firestore
-
-  
-def app():
-    db=firestore.client()
-
-
-    try:
-        st.title('Chats by: '+st.session_state['username'] )
-
-            
-        result = db.collection('Chats').document(st.session_state['username']).get()
-        r=result.to_dict()
-        content = r['Content']
-            
-        
-        def delete_post(k):
-            c=int(k)
-            h=content[c]
-            try:
-                db.collection('Chats').document(st.session_state['username']).update({"Content": firestore.ArrayRemove([h])})
-                st.warning('Post deleted')
-            except:
-                st.write('Something went wrong..')
-                
-        for c in range(len(content)-1,-1,-1):
-            st.text_area(label='',value=content[c])
-            st.button('Delete Chats', on_click=delete_post, args=([c] ), key=c)        
-
-        
-    except:
-        if st.session_state.username=='':
+import streamlit as st
+from firebase_admin import firestore
+
+import chat_store
+import firebase_setup
+
+  
+def app():
+    firebase_setup.ensure_firebase()
+    db=firestore.client()
+
+
+    try:
+        st.title('Chats by: '+st.session_state['username'] )
+
+        username = st.session_state['username']
+        # Newest page first; older exchanges are read one page at a time
+        content = chat_store.history_window(st.session_state, db, username, key='your_posts')
+            
+        
+        def delete_post(k):
+            c=int(k)
+            h=content[c]
+            try:
+                chat_store.delete_exchange(db, username, h['id'])
+                st.session_state['your_posts'] = [chat for chat in content if chat['id'] != h['id']]
+                chat_store.reset_history(st.session_state)
+                st.warning('Post deleted')
+            except:
+                st.write('Something went wrong..')
+                
+        for c in range(len(content)):
+            st.text_area(label='',value=str({content[c]['question']: content[c]['answer']}), key=f"post_{content[c]['id']}")
+            st.button('Delete Chats', on_click=delete_post, args=([c] ), key=content[c]['id'])        
+
+        if chat_store.has_older(st.session_state, key='your_posts'):
+            st.button('Load older chats', on_click=chat_store.load_older, args=(st.session_state, db, username, 'your_posts'))
+
+        
+    except:
+        if st.session_state.username=='':
             st.text('Please Login first')        
\ No newline at end of file